@@ -1 +1,2 @@
-from .app import Anki
\ No newline at end of file
+from .app import Anki
+from .build import build_packages, BuildResult
@@ -0,0 +1,292 @@
+import asyncio
+import os
+import queue
+import threading
+import weakref
+
+from .app import Anki
+
+_semaphore = None
+_semaphore_lock = threading.Lock()
+
+
+def shared_semaphore():
+    """Semaphore shared by the AsyncAnki without one of their own, with one slot per CPU.
+    A collection holds a slot only while it is opened, or while a batch of its operations runs,
+    so that idle collections do not keep the others waiting.
+
+    :return threading.Semaphore:
+    """
+    global _semaphore
+
+    with _semaphore_lock:
+        if _semaphore is None:
+            _semaphore = threading.Semaphore(os.cpu_count() or 1)
+
+    return _semaphore
+
+
+class _Operation:
+    __slots__ = ('name', 'args', 'kwargs', 'future', 'coalesce')
+
+    def __init__(self, name, args, kwargs, future, coalesce):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.coalesce = coalesce
+
+    def __call__(self, anki):
+        return getattr(anki, self.name)(*self.args, **self.kwargs)
+
+
+class AsyncAnki:
+    def __init__(self, filename, semaphore=None, **kwargs):
+        """Awaitable facade of Anki for asyncio code. The collection is opened and used by a worker thread
+        of its own, since sqlite3 connections are bound to their thread. The worker holds the semaphore
+        while it runs, so that at most that many collections are worked on at once.
+
+        Operations waiting in the queue when the worker is free are run together in one transaction.
+        If that fails, they are run again one by one, so that only the failing ones raise.
+
+        A collection that is garbage collected, or whose open() is cancelled or fails, is closed without saving.
+
+        :param str|file filename: see Anki
+        :param threading.Semaphore semaphore: defaults to shared_semaphore()
+        :param kwargs: passed to Anki
+        """
+        self.filename = filename
+        self.semaphore = semaphore
+        self._kwargs = kwargs
+        self._worker = None
+        self._finalizer = None
+        self._closed = False
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self):
+        """Wait until the collection is open. Other methods open it as needed.
+        """
+        self._start()
+        try:
+            await asyncio.shield(self._worker.ready)
+        except BaseException:
+            self._abort()
+            raise
+
+    async def deck(self, name, create=None):
+        """
+        :return AsyncDeck:
+        """
+        deck = await self._submit('deck', name, create=create)
+        return AsyncDeck(deck.name, deck.id, self)
+
+    async def new_deck(self, deck_name):
+        return await self.deck(deck_name, create=True)
+
+    async def get_deck(self, deck_name):
+        return await self.deck(deck_name, create=False)
+
+    async def new_model(self, name, fields, templates=None, css=None):
+        return await self._submit('new_model', name, fields, templates=templates, css=css)
+
+    async def add_item(self, *args, **kwargs):
+        return await self.add_items([args], **kwargs)
+
+    async def add_items(self, items, **kwargs):
+        """See AnkiDatabase.add_items. items are read in the worker thread. Only lists and tuples
+        are run together with other operations, as a generator cannot be read again if the batch fails.
+        """
+        return await self._submit('add_items', items, _coalesce=isinstance(items, (list, tuple)), **kwargs)
+
+    async def stats(self):
+        """See AnkiDatabase.stats.
+        """
+        return await self._submit('stats', _coalesce=False)
+
+    async def save(self):
+        return await self._submit('save', _coalesce=False)
+
+    async def close(self, save=True):
+        if self._closed:
+            return
+        if self._worker is None:
+            self._closed = True
+            return
+
+        try:
+            await self._submit('close', save=save, _coalesce=False)
+        finally:
+            self._closed = True
+            self._finalizer.detach()
+
+    def _start(self):
+        if self._worker is not None:
+            return
+
+        semaphore = self.semaphore if self.semaphore is not None else shared_semaphore()
+        self._worker = _Worker(self.filename, self._kwargs, asyncio.get_running_loop(), semaphore)
+        # The worker does not refer to self, so that a collection nobody closes is still collected.
+        self._finalizer = weakref.finalize(self, self._worker.stop)
+        self._worker.thread.start()
+
+    def _abort(self):
+        self._closed = True
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def _submit(self, name, *args, _coalesce=True, **kwargs):
+        if self._closed:
+            raise ValueError('{} is closed.'.format(self.filename))
+
+        self._start()
+        future = self._worker.loop.create_future()
+        self._worker.queue.put(_Operation(name, args, kwargs, future, _coalesce))
+
+        return future
+
+
+class _Worker:
+    def __init__(self, filename, kwargs, loop, semaphore):
+        self.filename = filename
+        self.kwargs = kwargs
+        self.loop = loop
+        self.semaphore = semaphore
+        self.queue = queue.SimpleQueue()
+        self.ready = loop.create_future()
+        self.thread = threading.Thread(target=self.run, name='AnkiPy', daemon=True)
+
+    def stop(self):
+        """Close the collection without saving, once the operations already queued are done.
+        """
+        self.queue.put(_Operation('close', (), {'save': False}, None, False))
+
+    def resolve(self, future, result=None, error=None):
+        if future is None:
+            return
+
+        def resolve():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        try:
+            self.loop.call_soon_threadsafe(resolve)
+        except RuntimeError:
+            # The event loop is closed, and nobody awaits the result anymore.
+            pass
+
+    def run(self):
+        """Body of the worker thread.
+        """
+        try:
+            with self.semaphore:
+                anki = Anki(self.filename, **self.kwargs)
+        except BaseException as e:
+            self.resolve(self.ready, error=e)
+            self.fail_pending(e)
+            return
+
+        self.resolve(self.ready)
+
+        while True:
+            operations = [self.queue.get()]
+            with self.semaphore:
+                while True:
+                    try:
+                        operations.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if self.run_operations(anki, operations):
+                    return
+
+    def run_operations(self, anki, operations):
+        """
+        :return bool: whether the collection was closed
+        """
+        group = []
+        for i, operation in enumerate(operations):
+            if operation.coalesce:
+                group.append(operation)
+                continue
+
+            self.run_group(anki, group)
+            group = []
+
+            done = self.run_one(anki, operation, transaction=False)
+            if operation.name == 'close':
+                if not done:
+                    anki.close(save=False)
+
+                error = ValueError('{} is closed.'.format(self.filename))
+                for later in operations[i + 1:]:
+                    self.resolve(later.future, error=error)
+                self.fail_pending(error)
+                return True
+
+        self.run_group(anki, group)
+        return False
+
+    def run_group(self, anki, group):
+        if len(group) == 1:
+            self.run_one(anki, group[0])
+        elif group:
+            try:
+                with anki.transaction():
+                    results = [operation(anki) for operation in group]
+            except Exception:
+                for operation in group:
+                    self.run_one(anki, operation)
+            else:
+                for operation, result in zip(group, results):
+                    self.resolve(operation.future, result)
+
+    def run_one(self, anki, operation, transaction=True):
+        try:
+            if transaction:
+                with anki.transaction():
+                    result = operation(anki)
+            else:
+                result = operation(anki)
+        except BaseException as e:
+            self.resolve(operation.future, error=e)
+            return False
+
+        self.resolve(operation.future, result)
+        return True
+
+    def fail_pending(self, error):
+        while True:
+            try:
+                operation = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.resolve(operation.future, error=error)
+
+
+class AsyncDeck:
+    def __init__(self, name, deck_id, anki):
+        """
+
+        :param str name:
+        :param int deck_id:
+        :param AsyncAnki anki:
+        """
+        self.name = name
+        self.id = deck_id
+        self.anki = anki
+
+    async def add_item(self, *args, **kwargs):
+        return await self.anki.add_item(deck=self.name, *args, **kwargs)
+
+    async def add_items(self, items, **kwargs):
+        return await self.anki.add_items(items, deck=self.name, **kwargs)
@@ -0,0 +1,194 @@
+"""Aggregates of the review log and of the scheduling of cards, computed with NumPy.
+
+Rows are read chunk_size at a time and reduced chunk by chunk, or grouped by SQLite, so that memory
+does not grow with the size of the collection. NumPy is imported when first needed, as it is an optional dependency.
+"""
+from collections import OrderedDict
+from itertools import chain
+from time import time
+
+from .tools.chunks import fetch_chunks
+
+CHUNK_SIZE = 100000
+RETENTION_BUCKETS = (1, 3, 7, 14, 30, 60, 120, 240, 365)
+
+_DAY_MS = 86400 * 1000
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError('AnkiPy.analytics needs NumPy: pip install numpy') from e
+
+    return numpy
+
+
+def _arrays(anki, sql, params=(), chunk_size=CHUNK_SIZE):
+    """Integer arrays of shape (rows, columns), of chunk_size rows at most.
+    """
+    np = _numpy()
+    cursor = anki.conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+
+    width = len(cursor.description)
+    for rows in fetch_chunks(cursor, chunk_size):
+        yield np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * width).reshape(-1, width)
+
+
+def _revlog_filter(anki, deck=None, since=None):
+    conditions = []
+    params = []
+    if deck is not None:
+        conditions.append('cid IN (SELECT id FROM cards WHERE did = ?)')
+        params.append(anki.get_deck(deck).id)
+    if since is not None:
+        conditions.append('id >= ?')
+        params.append(int(since * 1000))
+
+    return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', tuple(params)
+
+
+def daily_reviews(anki, deck=None, since=None, chunk_size=CHUNK_SIZE):
+    """Number of reviews and time spent reviewing per UTC day, from the first to the last review.
+
+    :param AnkiDatabase anki:
+    :param str deck: only reviews of the cards of this deck
+    :param int since: only reviews at or after this epoch second
+    :param int chunk_size:
+    :return OrderedDict: 'day' (datetime64[D]), 'reviews' and 'seconds' arrays
+    """
+    np = _numpy()
+    where, params = _revlog_filter(anki, deck=deck, since=since)
+    # Separate subqueries, so that SQLite reads each bound from the end of the primary key.
+    first, last = anki.conn.execute('SELECT (SELECT min(id) FROM revlog{0}), (SELECT max(id) FROM revlog{0})'
+                                    .format(where), params * 2).fetchone()
+    if first is None:
+        return OrderedDict([('day', np.array([], dtype='datetime64[D]')),
+                            ('reviews', np.zeros(0, dtype=np.int64)),
+                            ('seconds', np.zeros(0))])
+
+    first_day = first // _DAY_MS
+    n_days = last // _DAY_MS - first_day + 1
+    reviews = np.zeros(n_days, dtype=np.int64)
+    milliseconds = np.zeros(n_days)
+
+    for chunk in _arrays(anki, 'SELECT id, time FROM revlog' + where, params, chunk_size):
+        days = chunk[:, 0] // _DAY_MS - first_day
+        reviews += np.bincount(days, minlength=n_days)
+        milliseconds += np.bincount(days, weights=chunk[:, 1], minlength=n_days)
+
+    return OrderedDict([
+        ('day', np.arange(first_day, first_day + n_days).astype('datetime64[D]')),
+        ('reviews', reviews),
+        ('seconds', milliseconds / 1000)
+    ])
+
+
+def ease_distribution(anki, deck=None, since=None, chunk_size=CHUNK_SIZE):
+    """Number of answers per review type and button.
+
+    :return numpy.ndarray: of shape (4, 4), indexed by [type, ease - 1], type being 0=learn, 1=review,
+        2=relearn, 3=cram
+    """
+    np = _numpy()
+    where, params = _revlog_filter(anki, deck=deck, since=since)
+    counts = np.zeros(16, dtype=np.int64)
+
+    for chunk in _arrays(anki, 'SELECT type, ease FROM revlog' + where, params, chunk_size):
+        valid = (chunk[:, 0] >= 0) & (chunk[:, 0] < 4) & (chunk[:, 1] >= 1) & (chunk[:, 1] <= 4)
+        counts += np.bincount(chunk[valid, 0] * 4 + chunk[valid, 1] - 1, minlength=16)
+
+    return counts.reshape(4, 4)
+
+
+def retention(anki, buckets=RETENTION_BUCKETS, deck=None, since=None, chunk_size=CHUNK_SIZE):
+    """Share of review answers that were not 'Again', by the interval in days before the review.
+
+    :param tuple buckets: lower bound of each interval bucket, in days, increasing
+    :return OrderedDict: 'interval' (lower bound of the bucket), 'reviews' and 'retention' arrays.
+        retention is NaN for a bucket without reviews.
+    """
+    np = _numpy()
+    edges = np.asarray(buckets, dtype=np.int64)
+    where, params = _revlog_filter(anki, deck=deck, since=since)
+    where += (' AND ' if where else ' WHERE ') + 'type = 1 AND lastIvl >= ?'
+    params += (int(edges[0]), )
+
+    reviews = np.zeros(len(edges), dtype=np.int64)
+    passed = np.zeros(len(edges), dtype=np.int64)
+    for chunk in _arrays(anki, 'SELECT lastIvl, ease FROM revlog' + where, params, chunk_size):
+        bucket = np.searchsorted(edges, chunk[:, 0], side='right') - 1
+        reviews += np.bincount(bucket, minlength=len(edges))
+        passed += np.bincount(bucket[chunk[:, 1] > 1], minlength=len(edges))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = passed / reviews
+
+    return OrderedDict([('interval', edges), ('reviews', reviews), ('retention', rate)])
+
+
+def due_forecast(anki, days=30, chunk_size=CHUNK_SIZE):
+    """Number of review and learning cards due on each of the next days, per deck.
+    Overdue cards are counted today.
+
+    :param int days:
+    :return OrderedDict: deck name -> array of the number of cards due on each day, today first
+    """
+    np = _numpy()
+    crt = anki.conn.execute('SELECT crt FROM col').fetchone()[0]
+    today = int((time() - crt) // 86400)
+
+    deck_ids = [int(deck_id) for deck_id in anki._decks.keys()]
+    deck_index = dict((deck_id, i) for i, deck_id in enumerate(deck_ids))
+    counts = np.zeros(len(deck_ids) * days, dtype=np.int64)
+    sorted_ids = np.array(sorted(deck_ids), dtype=np.int64)
+    sorted_index = np.array([deck_index[deck_id] for deck_id in sorted(deck_ids)], dtype=np.int64)
+
+    # Review cards are due on a day number since the collection creation, learning cards on an epoch second.
+    for chunk in _arrays(anki, 'SELECT did, queue, due FROM cards WHERE queue IN (1, 2, 3) AND '
+                               '(queue = 1 OR due < ?)', (today + days, ), chunk_size):
+        due = np.where(chunk[:, 1] == 1, (chunk[:, 2] - crt) // 86400, chunk[:, 2]) - today
+        due = np.clip(due, 0, None)
+        position = np.searchsorted(sorted_ids, chunk[:, 0])
+        known = (position < len(sorted_ids)) & (due < days)
+        known[known] = sorted_ids[position[known]] == chunk[known, 0]
+
+        counts += np.bincount(sorted_index[position[known]] * days + due[known], minlength=len(counts))
+
+    counts = counts.reshape(len(deck_ids), days)
+    return OrderedDict((anki._decks[str(deck_id)]['name'], counts[i]) for i, deck_id in enumerate(deck_ids)
+                       if counts[i].any())
+
+
+def lapse_hotspots(anki, limit=20, min_lapses=1, deck=None):
+    """Notes whose cards lapsed the most. The lapses are summed per note by SQLite, which keeps
+    a row per note rather than per card, and only the top rows are read.
+
+    :param int limit:
+    :param int min_lapses: ignore cards with fewer lapses
+    :param str deck:
+    :return list: OrderedDicts of 'nid', 'sfld', 'lapses' and 'reps' of the cards of the note,
+        and 'lapse_rate' (lapses per review), most lapses first
+    """
+    where = ' WHERE lapses >= ?'
+    params = (min_lapses, )
+    if deck is not None:
+        where += ' AND did = ?'
+        params += (anki.get_deck(deck).id, )
+
+    cursor = anki.conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute('SELECT c.nid, n.sfld, c.lapses, c.reps FROM (SELECT nid, sum(lapses) AS lapses, '
+                          'sum(reps) AS reps FROM cards{} GROUP BY nid ORDER BY lapses DESC, nid LIMIT ?) c '
+                          'LEFT JOIN notes n ON n.id = c.nid ORDER BY c.lapses DESC, c.nid'.format(where),
+                          params + (limit, )).fetchall()
+
+    return [OrderedDict([
+        ('nid', nid),
+        ('sfld', sfld),
+        ('lapses', lapses),
+        ('reps', reps),
+        ('lapse_rate', lapses / reps if reps else None)
+    ]) for nid, sfld, lapses, reps in rows]
@@ -2,259 +2,305 @@ import sqlite3
 import json
 from collections import OrderedDict
 from copy import deepcopy
-from time import time
-from bs4 import BeautifulSoup
+from time import time, perf_counter
 from hashlib import sha1
-from zipfile import ZipFile
-from tempfile import mkdtemp
-from pathlib import Path
+from zipfile import ZipFile, ZIP_DEFLATED
+from tempfile import mkdtemp, mkstemp, SpooledTemporaryFile
+import os
+from pathlib import Path, PurePath
 import shutil
 import atexit
 import re
+from contextlib import contextmanager
 
 from .tools.defaults import DEFAULTS
+from .tools.schema import SCHEMA
 from .tools.guid import guid64
+from .tools.text import strip_html, keep_media_names
+from .tools.chunks import chunks, fetch_chunks
+from .records import AnkiNote, AnkiCard, InsertStatement
+from .media import AnkiMedia
+from .merge import merge_collection
+from .delta import export_delta
+from .render import render_cards
+from . import search as search_index
+from .importer import import_file
+from .stats import AnkiStats, TracedConnection, NULL_TIMER
+
+
+def _checksum(text):
+    """Integer of the first 8 hex digits of the sha1 of text, as Anki stores in notes.csum.
+    """
+    return int.from_bytes(sha1(text.encode('utf8')).digest()[:4], 'big')
+
+
+def _field_checksum(field, sfld, sfld_extractor):
+    """Checksum of the first field of a note. As in Anki, the file names of its images are kept,
+    so that notes whose first field is only an image are told apart.
+
+    :param str field: first field, as HTML
+    :param str sfld: sfld_extractor(field)
+    :param callable sfld_extractor:
+    """
+    with_media = keep_media_names(field)
+    if with_media != field:
+        return _checksum(sfld_extractor(with_media))
+
+    return _checksum(sfld)
+
+
+def _where(conditions):
+    if not conditions:
+        return ''
+
+    return ' WHERE ' + ' AND '.join(conditions)
 
 
 class AnkiDatabase:
-    def __init__(self, conn):
+    def __init__(self, conn, autocommit=True, sfld_extractor=None, instrument=False, on_operation=None,
+                 trace_sql=False):
         """
 
         :param sqlite3.Connection conn:
+        :param bool autocommit: commit after every mutating call. If False, changes are only committed
+            by commit(), save() or at the end of a transaction().
+        :param callable sfld_extractor: function returning the sort field text of an HTML field.
+            Defaults to tools.text.strip_html; use tools.text.bs4_text to parse with BeautifulSoup.
+        :param bool instrument: keep counters and timers of operations and phases, see stats().
+            Implied by on_operation and trace_sql.
+        :param callable on_operation: called with (name, seconds, rows) after each timed operation or phase
+        :param bool trace_sql: log every SQL statement with its timing to the 'AnkiPy.sql' logger, at DEBUG level
         """
+        self._stats = None
+        if instrument or on_operation is not None or trace_sql:
+            self._stats = AnkiStats(on_operation=on_operation)
+            conn = TracedConnection(conn, self._stats, trace=trace_sql)
+
         self.conn = conn
         self.conn.row_factory = sqlite3.Row
+        self.autocommit = autocommit
+        self.sfld_extractor = strip_html if sfld_extractor is None else sfld_extractor
+        self._transaction_depth = 0
 
-        self.ids = dict()
+        self._search_ready = False
+        self._untracked_changes = 0
+        self._untracked_depth = 0
+
+        self._last_id = dict()
+        self._insert_statements = None
 
         self.init()
 
     def init(self):
         cursor = self.conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE type="table" AND name = "col"')
         if cursor.fetchone()[0] != 1:
-            self.conn.executescript('''
--- Cards are what you review. 
--- There can be multiple cards for each note, as determined by the Template.
-CREATE TABLE cards (
-    id              integer primary key,
-      -- the epoch milliseconds of when the card was created
-    nid             integer not null,--    
-      -- notes.id
-    did             integer not null,
-      -- deck id (available in col table)
-    ord             integer not null,
-      -- ordinal : identifies which of the card templates it corresponds to 
-      --   valid values are from 0 to num templates - 1
-    mod             integer not null,
-      -- modificaton time as epoch seconds
-    usn             integer not null,
-      -- update sequence number : used to figure out diffs when syncing. 
-      --   value of -1 indicates changes that need to be pushed to server. 
-      --   usn < server usn indicates changes that need to be pulled from server.
-    type            integer not null,
-      -- 0=new, 1=learning, 2=due, 3=filtered
-    queue           integer not null,
-      -- -3=sched buried, -2=user buried, -1=suspended,
-      -- 0=new, 1=learning, 2=due (as for type)
-      -- 3=in learning, next rev in at least a day after the previous review
-    due             integer not null,
-     -- Due is used differently for different card types: 
-     --   new: note id or random int
-     --   due: integer day, relative to the collection's creation time
-     --   learning: integer timestamp
-    ivl             integer not null,
-      -- interval (used in SRS algorithm). Negative = seconds, positive = days
-    factor          integer not null,
-      -- factor (used in SRS algorithm)
-    reps            integer not null,
-      -- number of reviews
-    lapses          integer not null,
-      -- the number of times the card went from a "was answered correctly" 
-      --   to "was answered incorrectly" state
-    left            integer not null,
-      -- reps left till graduation
-    odue            integer not null,
-      -- original due: only used when the card is currently in filtered deck
-    odid            integer not null,
-      -- original did: only used when the card is currently in filtered deck
-    flags           integer not null,
-      -- currently unused
-    data            text not null
-      -- currently unused
-);
-
--- col contains a single row that holds various information about the collection
-CREATE TABLE col (
-    id              integer primary key,
-      -- arbitrary number since there is only one row
-    crt             integer not null,
-      -- created timestamp
-    mod             integer not null,
-      -- last modified in milliseconds
-    scm             integer not null,
-      -- schema mod time: time when "schema" was modified. 
-      --   If server scm is different from the client scm a full-sync is required
-    ver             integer not null,
-      -- version
-    dty             integer not null,
-      -- dirty: unused, set to 0
-    usn             integer not null,
-      -- update sequence number: used for finding diffs when syncing. 
-      --   See usn in cards table for more details.
-    ls              integer not null,
-      -- "last sync time"
-    conf            text not null,
-      -- json object containing configuration options that are synced
-    models          text not null,
-      -- json array of json objects containing the models (aka Note types)
-    decks           text not null,
-      -- json array of json objects containing the deck
-    dconf           text not null,
-      -- json array of json objects containing the deck options
-    tags            text not null
-      -- a cache of tags used in the collection (This list is displayed in the browser. Potentially at other place)
-);
-
--- Contains deleted cards, notes, and decks that need to be synced. 
--- usn should be set to -1, 
--- oid is the original id.
--- type: 0 for a card, 1 for a note and 2 for a deck
-CREATE TABLE graves (
-    usn             integer not null,
-    oid             integer not null,
-    type            integer not null
-);
-
--- Notes contain the raw information that is formatted into a number of cards
--- according to the models
-CREATE TABLE notes (
-    id              integer primary key,
-      -- epoch seconds of when the note was created
-    guid            text not null,
-      -- globally unique id, almost certainly used for syncing
-    mid             integer not null,
-      -- model id
-    mod             integer not null,
-      -- modification timestamp, epoch seconds
-    usn             integer not null,
-      -- update sequence number: for finding diffs when syncing.
-      --   See the description in the cards table for more info
-    tags            text not null,
-      -- space-separated string of tags. 
-      --   includes space at the beginning and end, for LIKE "% tag %" queries
-    flds            text not null,
-      -- the values of the fields in this note. separated by 0x1f (31) character.
-    sfld            text not null,
-      -- sort field: used for quick sorting and duplicate check
-    csum            integer not null,
-      -- field checksum used for duplicate check.
-      --   integer representation of first 8 digits of sha1 hash of the first field
-    flags           integer not null,
-      -- unused
-    data            text not null
-      -- unused
-);
-
--- revlog is a review history; it has a row for every review you've ever done!
-CREATE TABLE revlog (
-    id              integer primary key,
-       -- epoch-milliseconds timestamp of when you did the review
-    cid             integer not null,
-       -- cards.id
-    usn             integer not null,
-        -- update sequence number: for finding diffs when syncing. 
-        --   See the description in the cards table for more info
-    ease            integer not null,
-       -- which button you pushed to score your recall. 
-       -- review:  1(wrong), 2(hard), 3(ok), 4(easy)
-       -- learn/relearn:   1(wrong), 2(ok), 3(easy)
-    ivl             integer not null,
-       -- interval
-    lastIvl         integer not null,
-       -- last interval
-    factor          integer not null,
-      -- factor
-    time            integer not null,
-       -- how many milliseconds your review took, up to 60000 (60s)
-    type            integer not null
-       --  0=learn, 1=review, 2=relearn, 3=cram
-);
-
-
-CREATE INDEX ix_cards_nid on cards (nid);
-CREATE INDEX ix_cards_sched on cards (did, queue, due);
-CREATE INDEX ix_cards_usn on cards (usn);
-CREATE INDEX ix_notes_csum on notes (csum);
-CREATE INDEX ix_notes_usn on notes (usn);
-CREATE INDEX ix_revlog_cid on revlog (cid);
-CREATE INDEX ix_revlog_usn on revlog (usn);
-            ''')
-
-        self.ids = {
-            'did': set(),
-            'mid': set(),
-            'nid': set(),
-            'cid': set(),
-            'guid': set()
-        }
-
-        cursor = self.conn.execute('SELECT decks, models FROM col')
-        for row in cursor:
-            self.ids['did'] = set(json.loads(row['decks']).keys())
-            self.ids['mid'] = set(json.loads(row['models']).keys())
-
-        cursor = self.conn.execute('SELECT id, guid FROM notes')
-        for row in cursor:
-            self.ids['nid'].add(row[0])
-            self.ids['guid'].add(row[1])
-
-        cursor = self.conn.execute('SELECT id FROM cards')
-        for row in cursor:
-            self.ids['cid'].add(row[0])
+            self.conn.executescript(SCHEMA)
 
-    def deck(self, name, create=None):
-        col = deepcopy(DEFAULTS['col'])
+        self._load_col()
 
-        db_col = self.conn.execute('SELECT decks FROM col').fetchone()
-        if db_col is None:
-            if create is False:
-                raise ValueError('{} does not exists.'.format(name))
-            else:
-                decks = dict()
-                # models = dict()
-                col.update({
-                    'decks': json.dumps(decks),
-                    # 'models': json.dumps(models)
-                })
-                self.conn.execute('INSERT INTO col ({}) VALUES ({})'.format(','.join(col.keys()),
-                                                                            ','.join('?' for _ in col.keys())),
-                                  tuple(col.values()))
+    def stats(self):
+        """Counters and cumulative timers, by operation ('add_items', 'commit', 'save', 'merge', 'import_file')
+        and by phase ('sql', 'json', 'html', 'ids', 'zip'). Empty unless the collection was opened with
+        instrument, on_operation or trace_sql.
+
+        :return OrderedDict: name -> OrderedDict of 'count', 'seconds' and 'rows'
+        """
+        if self._stats is None:
+            return OrderedDict()
+
+        return self._stats.as_dict()
+
+    def _timer(self, name, rows=0):
+        if self._stats is None:
+            return NULL_TIMER
+
+        return self._stats.timer(name, rows)
+
+    def _load_col(self):
+        """Read decks, models and dconf from col once, and keep them in memory until the next commit.
+        """
+        row = self.conn.execute('SELECT decks, models, dconf FROM col').fetchone()
+        self._col_new = row is None
+        if row is None:
+            row = deepcopy(DEFAULTS['col'])
+            row['decks'] = json.dumps(dict())
+
+        with self._timer('json'):
+            self._decks = json.loads(row['decks'], object_pairs_hook=OrderedDict)
+            self._models = json.loads(row['models'], object_pairs_hook=OrderedDict)
+            self._dconf = json.loads(row['dconf'], object_pairs_hook=OrderedDict)
+        self._col_dirty = self._col_new
+
+        self._deck_ids = {v['name']: k for k, v in self._decks.items()}
+        self._model_ids = {v['name']: k for k, v in self._models.items()}
+        self._deck_cache = dict()
+
+    def _flush_col(self):
+        if not self._col_dirty:
+            return
+
+        with self._timer('json'):
+            values = OrderedDict([
+                ('mod', int(time() * 1000)),
+                ('models', json.dumps(self._models)),
+                ('decks', json.dumps(self._decks)),
+                ('dconf', json.dumps(self._dconf))
+            ])
+
+        if self._col_new:
+            col = deepcopy(DEFAULTS['col'])
+            col.update(values)
+            self.conn.execute('INSERT INTO col ({}) VALUES ({})'.format(','.join(col.keys()),
+                                                                        ','.join('?' for _ in col.keys())),
+                              tuple(col.values()))
+            self._col_new = False
         else:
-            decks = json.loads(db_col[0], object_pairs_hook=OrderedDict)
+            self.conn.execute('UPDATE col SET {}'.format(','.join('{}=?'.format(k) for k in values.keys())),
+                              tuple(values.values()))
+
+        self._col_dirty = False
+
+    def commit(self):
+        """Write the cached decks and models back to col, then commit.
+        """
+        with self._timer('commit'):
+            self._flush_col()
+            self.conn.commit()
+
+    def rollback(self):
+        """Discard uncommitted changes, including those to the cached decks and models.
+        """
+        self.conn.rollback()
+        self._load_col()
+        self._search_ready = search_index.is_built(self.conn)
+
+    @contextmanager
+    def transaction(self):
+        """Commit everything done inside the block at once, or roll it back on an exception.
+        Nested transactions are part of the outermost one.
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.rollback()
+            raise
+
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.commit()
+
+    @contextmanager
+    def bulk_load(self):
+        """Fast mode for large one-shot imports. Journaling and syncing are relaxed, and the secondary
+        indexes are dropped while the block runs in a single transaction. They are recreated, and ANALYZE is run,
+        when the block exits.
+
+        Yields a dict, which receives the duration in seconds of the 'load' and 'rebuild' phases.
+        If the block raises, the load is rolled back before the indexes are recreated.
+        """
+        if self._transaction_depth:
+            raise ValueError('Cannot bulk load inside a transaction.')
+        self.commit()
+
+        timing = OrderedDict()
+        pragmas = OrderedDict((name, self.conn.execute('PRAGMA {}'.format(name)).fetchone()[0])
+                              for name in ('journal_mode', 'synchronous', 'cache_size', 'temp_store'))
+        indexes = self.conn.execute('SELECT name, sql FROM sqlite_master '
+                                    'WHERE type="index" AND sql IS NOT NULL').fetchall()
+
+        self.conn.execute('PRAGMA journal_mode=MEMORY')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA cache_size=-200000')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        for index in indexes:
+            self.conn.execute('DROP INDEX {}'.format(index['name']))
+
+        start = perf_counter()
+        try:
+            with self.transaction():
+                yield timing
+        finally:
+            timing['load'] = perf_counter() - start
+            if self.conn.in_transaction:
+                self.rollback()
+
+            start = perf_counter()
+            for index in indexes:
+                self.conn.execute(index['sql'])
+            self.conn.execute('ANALYZE')
+            self.conn.commit()
+            timing['rebuild'] = perf_counter() - start
 
-        deck = None
-        for v in decks.values():
-            if name == v['name']:
-                deck = v
+            for name, value in pragmas.items():
+                self.conn.execute('PRAGMA {}={}'.format(name, value))
+
+    @contextmanager
+    def _untracked(self):
+        """Rows written in the block to the search index or to temp tables, which do not make the package
+        need saving, are left out of _changes(). Only the outermost block counts them.
+        """
+        if self._untracked_depth:
+            yield
+            return
+
+        changes = self.conn.total_changes
+        self._untracked_depth += 1
+        try:
+            yield
+        finally:
+            self._untracked_depth -= 1
+            self._untracked_changes += self.conn.total_changes - changes
+
+    def _changes(self):
+        """Number of rows written to the collection since the connection was opened.
+        """
+        return self.conn.total_changes - self._untracked_changes
+
+    @contextmanager
+    def _writing(self):
+        if self.autocommit:
+            with self.transaction():
+                yield
+        else:
+            yield
+
+    def _autocommit(self):
+        if self.autocommit and self._transaction_depth == 0:
+            self.commit()
+
+    def deck(self, name, create=None):
+        deck = self._deck_cache.get(name)
+        if deck is None:
+            deck_id = self._deck_ids.get(name)
+            if deck_id is not None:
+                deck = self._deck_cache[name] = AnkiDeck(self._decks[deck_id], self)
 
         if deck is not None:
             if create is True:
                 raise ValueError('{} already exists'.format(name))
             else:
-                return AnkiDeck(deck, self)
+                return deck
+        elif create is False:
+            raise ValueError('{} does not exists.'.format(name))
         else:
-            col = deepcopy(DEFAULTS['col'])
             deck_id = self._new_id('did')
-            decks[str(deck_id)] = tuple(json.loads(col['decks']).values())[0]
-            decks[str(deck_id)].update({
+            deck = tuple(json.loads(DEFAULTS['col']['decks'], object_pairs_hook=OrderedDict).values())[0]
+            deck.update({
                 'id': deck_id,
-                'name': name
+                'name': name,
+                'mod': int(time()),
+                'usn': -1
             })
 
-            self.conn.execute('UPDATE col SET decks=?', (json.dumps(decks), ))
-            self.conn.commit()
+            self._decks[str(deck_id)] = deck
+            self._deck_ids[name] = str(deck_id)
+            self._col_dirty = True
+            self._autocommit()
 
-            return AnkiDeck(decks[str(deck_id)], self)
+            return self.deck(name)
 
     def new_deck(self, deck_name):
         return self.deck(deck_name, create=True)
@@ -263,91 +309,213 @@ CREATE INDEX ix_revlog_usn on revlog (usn);
         return self.deck(deck_name, create=False)
 
     def add_item(self, *args, **kwargs):
-        note = deepcopy(DEFAULTS['notes'])
-        sfld = BeautifulSoup(args[0], 'html.parser').text
-        nid = self._new_id('nid')
-
-        model = self._model(name=kwargs.get('model', 'Basic'))
-
-        note.update({
-            'id': nid,
-            'guid': self._new_guid(),
-            'mid': model['id'],
-            'mod': int(time()),
-            'tags': kwargs.get('tags', ''),
-            'flds': '\x1f'.join(args),
-            'sfld': sfld,
-            'csum': sha1(sfld.encode('utf8')).hexdigest()
-        })
-
-        self.conn.execute('INSERT INTO notes ({}) VALUES ({})'.format(','.join(note.keys()),
-                                                                      ','.join('?' for _ in note.keys())),
-                          tuple(note.values()))
-
-        card = deepcopy(DEFAULTS['cards'])
-        cid = self._new_id('cid')
-
-        for order in range(len(model['tmpls'])):
-            deck_names = kwargs.get('decks', None)
-            if deck_names is not None:
-                deck = self.deck(deck_names[order])
+        return self.add_items([args], **kwargs)
+
+    def add_items(self, items, deck='Default', decks=None, model='Basic', tags='', chunk_size=1000,
+                  on_duplicate='allow'):
+        """Add many notes in one transaction, resolving the model and the decks only once.
+
+        :param iterable items: tuples of fields, or dicts with 'fields' and optional 'tags' and 'deck'.
+            May be a generator.
+        :param str deck: deck of every card
+        :param list decks: deck name for each template of the model, overrides deck
+        :param str model: model name
+        :param str|list tags: tags of the items which do not define their own
+        :param int chunk_size: number of notes written per executemany
+        :param str on_duplicate: what to do with an item whose sort field already exists in the model:
+            'allow' adds it anyway, 'skip' ignores it, 'update' overwrites the fields and tags of the existing note,
+            'error' raises ValueError.
+        :return int: number of notes written
+        """
+        if on_duplicate not in ('allow', 'skip', 'update', 'error'):
+            raise ValueError('Invalid on_duplicate: {}'.format(on_duplicate))
+
+        note_insert, card_insert = self._inserts()
+        note_defaults = note_insert.defaults
+        card_defaults = card_insert.defaults
+        new_guid = self._new_guid
+        update_sql = 'UPDATE notes SET flds=?, tags=?, mod=?, usn=-1 WHERE id=? AND (flds != ? OR tags != ?)'
+
+        count = 0
+        with self._timer('add_items') as timer, self._writing():
+            model = self._model(name=model)
+            mid = model['id']
+            if decks is not None:
+                deck_ids = [self.deck(decks[order]).id for order in range(len(model['tmpls']))]
             else:
-                deck = self.deck(kwargs.get('deck'))
-
-            card.update({
-                'id': cid,
-                'nid': nid,
-                'did': deck.id,
-                'ord': order,
-                'mod': int(time())
-            })
+                deck_ids = [self.deck(deck).id] * len(model['tmpls'])
+            default_tags = self._format_tags(tags)
+            sfld_extractor = self.sfld_extractor
+            item_deck_ids = dict()
+
+            for chunk in chunks(items, chunk_size):
+                notes = []
+                cards = []
+                updates = []
+                mod = int(time())
+
+                parsed = []
+                for item in chunk:
+                    note_deck_ids = deck_ids
+                    if isinstance(item, dict):
+                        fields = item['fields']
+                        note_tags = self._format_tags(item['tags']) if 'tags' in item else default_tags
+                        if item.get('deck') is not None:
+                            note_deck_ids = item_deck_ids.get(item['deck'])
+                            if note_deck_ids is None:
+                                note_deck_ids = item_deck_ids[item['deck']] = \
+                                    [self.deck(item['deck']).id] * len(model['tmpls'])
+                    else:
+                        fields = item
+                        note_tags = default_tags
+
+                    parsed.append((fields, note_tags, note_deck_ids))
+
+                with self._timer('html', len(parsed)):
+                    sflds = [sfld_extractor(fields[0]) for fields, _, _ in parsed]
+                entries = [('\x1f'.join(fields), note_tags, sfld, _field_checksum(fields[0], sfld, sfld_extractor),
+                            note_deck_ids) for (fields, note_tags, note_deck_ids), sfld in zip(parsed, sflds)]
+
+                if on_duplicate == 'allow':
+                    existing = None
+                else:
+                    existing = self._find_duplicates(mid, set((entry[3], entry[2]) for entry in entries))
+
+                with self._timer('ids', len(entries)):
+                    nid = self._reserve_ids('nid', len(entries)) - 1
+                    cid = self._reserve_ids('cid', len(entries) * len(deck_ids)) - 1
+
+                for flds, note_tags, sfld, csum, note_deck_ids in entries:
+                    if existing is not None:
+                        duplicate_id = existing.get((csum, sfld))
+                        if duplicate_id is not None:
+                            if on_duplicate == 'error':
+                                raise ValueError('Duplicate note: {}'.format(sfld))
+                            elif on_duplicate == 'update':
+                                updates.append((flds, note_tags, mod, duplicate_id, flds, note_tags))
+                            continue
+
+                    nid += 1
+                    if existing is not None:
+                        existing[(csum, sfld)] = nid
+
+                    notes.append((nid, new_guid(), mid, mod, note_tags, flds, sfld, csum) + note_defaults)
+                    for order, deck_id in enumerate(note_deck_ids):
+                        cid += 1
+                        cards.append((cid, nid, deck_id, order, mod) + card_defaults)
+
+                self.conn.executemany(note_insert.sql, notes)
+                self.conn.executemany(card_insert.sql, cards)
+                count += len(notes)
+
+                if updates:
+                    count += self.conn.executemany(update_sql, updates).rowcount
+
+                if self._search_ready:
+                    with self._untracked():
+                        search_index.index_notes(self, [(note[0], note[2], note[5]) for note in notes])
+                        if updates:
+                            search_index.unindex_notes(self, [update[3] for update in updates])
+                            search_index.index_notes(self, [(update[3], mid, update[0]) for update in updates])
+
+            timer.rows = count
+
+        return count
+
+    def _inserts(self):
+        """INSERT statements of notes and cards, built once per connection.
+
+        :return tuple: records.InsertStatement of notes, whose rows start with
+            (id, guid, mid, mod, tags, flds, sfld, csum), and of cards, whose rows start with (id, nid, did, ord, mod)
+        """
+        if self._insert_statements is None:
+            self._insert_statements = (
+                InsertStatement('notes', ('id', 'guid', 'mid', 'mod', 'tags', 'flds', 'sfld', 'csum'),
+                                DEFAULTS['notes']),
+                InsertStatement('cards', ('id', 'nid', 'did', 'ord', 'mod'), DEFAULTS['cards'])
+            )
 
-            self.conn.execute('INSERT INTO cards ({}) VALUES ({})'.format(','.join(card.keys()),
-                                                                          ','.join('?' for _ in card.keys())),
-                              tuple(card.values()))
-        self.conn.commit()
+        return self._insert_statements
+
+    def _find_duplicates(self, mid, keys):
+        """Look up existing notes by (csum, sfld), through ix_notes_csum.
+
+        :param int mid:
+        :param set keys: (csum, sfld) pairs
+        :return dict: (csum, sfld) -> note id
+        """
+        found = dict()
+        csums = list(set(csum for csum, _ in keys))
+        for i in range(0, len(csums), 500):
+            batch = csums[i:i + 500]
+            cursor = self.conn.execute('SELECT id, csum, sfld FROM notes WHERE csum IN ({}) AND mid = ?'
+                                       .format(','.join('?' for _ in batch)), tuple(batch) + (mid, ))
+            for row in cursor:
+                key = (row['csum'], row['sfld'])
+                if key in keys:
+                    found.setdefault(key, row['id'])
+
+        return found
+
+    @staticmethod
+    def _format_tags(tags):
+        if isinstance(tags, str):
+            tags = tags.split()
+        if not tags:
+            return ''
+
+        return ' {} '.format(' '.join(tags))
 
     def _new_id(self, id_type):
-        id_value = int(time() * 1000)
-        while id_value in self.ids[id_type]:
-            id_value += 1
-        self.ids[id_type].add(id_value)
+        return self._reserve_ids(id_type, 1)
 
-        return id_value
+    def _reserve_ids(self, id_type, count):
+        """Reserve a block of consecutive ids, which are epoch milliseconds if possible,
+        and always greater than every id already in the collection.
 
-    def _new_guid(self):
-        guid = guid64()
-        while guid in self.ids['guid']:
-            guid = guid64()
-        self.ids['guid'].add(guid)
+        :param str id_type: 'nid', 'cid', 'did' or 'mid'
+        :param int count:
+        :return int: the first id of the block
+        """
+        last_id = self._last_id.get(id_type)
+        if last_id is None:
+            if id_type == 'nid':
+                last_id = self.conn.execute('SELECT max(id) FROM notes').fetchone()[0]
+            elif id_type == 'cid':
+                last_id = self.conn.execute('SELECT max(id) FROM cards').fetchone()[0]
+            elif id_type == 'did':
+                last_id = max(int(k) for k in self._decks.keys()) if self._decks else None
+            else:
+                last_id = max(int(k) for k in self._models.keys()) if self._models else None
 
-        return guid
+        first_id = max(int(time() * 1000), (last_id or 0) + 1)
+        self._last_id[id_type] = first_id + count - 1
 
-    def _model(self, name):
-        cursor = self.conn.execute('SELECT models FROM col')
-        models = json.loads(cursor.fetchone()[0])
+        return first_id
 
-        for k, v in models.items():
-            if v['name'] == name:
-                return v
+    @staticmethod
+    def _new_guid():
+        """Random 64-bit guid. Existing guids are not loaded to check against: with a million notes,
+        the chance that a new guid collides is about 1 in 10**13.
+        Guids coming from another collection are checked when merging instead.
+        """
+        return guid64()
 
-        raise ValueError('{} not in models'.format(name))
+    def _model(self, name):
+        model_id = self._model_ids.get(name)
+        if model_id is None:
+            raise ValueError('{} not in models'.format(name))
+
+        return self._models[model_id]
 
     def new_model(self, name, fields, templates=None, css=None):
         col = deepcopy(DEFAULTS['col'])
 
-        cursor = self.conn.execute('SELECT models FROM col')
-        if cursor is None:
-            raise ValueError('A deck must be created first.')
-        else:
-            models = json.loads(cursor.fetchone()[0], object_pairs_hook=OrderedDict)
-
-        if name in models.keys():
+        if name in self._model_ids.keys():
             raise ValueError('{} already exists'.format(name))
         else:
             model_id = self._new_id('mid')
-            models[str(model_id)] = tuple(json.loads(col['models']).values())[0]
-            model = models[str(model_id)]
+            model = tuple(json.loads(col['models'], object_pairs_hook=OrderedDict).values())[0]
 
             flds = []
             for i, field_name in enumerate(fields):
@@ -359,7 +527,7 @@ CREATE INDEX ix_revlog_usn on revlog (usn);
                 flds.append(fld)
 
             if templates is None:
-                tmpls = self._model('Basic')['tmpls']
+                tmpls = deepcopy(self._model('Basic')['tmpls'])
             else:
                 tmpls = []
                 for i, template in enumerate(templates):
@@ -389,19 +557,382 @@ CREATE INDEX ix_revlog_usn on revlog (usn);
             if css is None:
                 css = self._model('Basic')['css']
 
-            models[str(model_id)].update({
+            model.update({
                 'name': name,
                 'flds': flds,
                 'id': model_id,
                 'mod': int(time()),
+                'usn': -1,
                 'tmpls': tmpls,
                 'css': css
             })
 
-            self.conn.execute('UPDATE col SET models=?', (json.dumps(models), ))
-            self.conn.commit()
+            self._models[str(model_id)] = model
+            self._model_ids[name] = str(model_id)
+            self._col_dirty = True
+            self._autocommit()
 
-            return models[str(model_id)]
+            return model
+
+    def update_notes(self, where, set_fields=None, add_tags=None, remove_tags=None, chunk_size=1000):
+        """Edit the fields and tags of many notes, with one executemany per chunk_size notes.
+        The sort field, checksum, modification time and usn of the changed notes are updated.
+
+        :param dict|list where: filters of iter_notes (deck, model, tag, since_mod, usn), or note ids.
+            where={} selects every note.
+        :param dict set_fields: field name -> new value, or function of the old value returning the new one
+        :param str|list add_tags:
+        :param str|list remove_tags:
+        :param int chunk_size:
+        :return int: number of notes changed
+        """
+        set_fields = OrderedDict(set_fields or dict())
+        add_tags = self._format_tags(add_tags or '').split()
+        remove_tags = set(self._format_tags(remove_tags or '').split())
+        sfld_extractor = self.sfld_extractor
+        update_sql = 'UPDATE notes SET flds=?, tags=?, sfld=?, csum=?, mod=?, usn=-1 WHERE id=?'
+
+        count = 0
+        with self._writing():
+            self._select_notes(where)
+            try:
+                if self._search_ready and set_fields and \
+                        self._count_rows('temp._selected_nid') > search_index.REBUILD_THRESHOLD:
+                    self._drop_search_index()
+
+                field_indexes = dict()
+                last_id = None
+                while True:
+                    rows = self.conn.execute('SELECT n.id, n.mid, n.flds, n.tags FROM temp._selected_nid s '
+                                             'JOIN notes n ON n.id = s.id WHERE s.id > ? ORDER BY s.id LIMIT ?',
+                                             (-1 if last_id is None else last_id, chunk_size)).fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1]['id']
+
+                    mod = int(time())
+                    updates = []
+                    reindexed = []
+                    for row in rows:
+                        indexes = field_indexes.get(row['mid'])
+                        if indexes is None:
+                            model = self._models[str(row['mid'])]
+                            names = [fld['name'] for fld in model['flds']]
+                            for name in set_fields.keys():
+                                if name not in names:
+                                    raise ValueError('{} not in fields of {}'.format(name, model['name']))
+
+                            indexes = field_indexes[row['mid']] = [(names.index(name), value)
+                                                                   for name, value in set_fields.items()]
+
+                        fields = row['flds'].split('\x1f')
+                        for i, value in indexes:
+                            fields[i] = value(fields[i]) if callable(value) else value
+                        flds = '\x1f'.join(fields)
+
+                        note_tags = [tag for tag in row['tags'].split() if tag not in remove_tags]
+                        note_tags.extend(tag for tag in add_tags if tag not in note_tags)
+                        note_tags = self._format_tags(note_tags)
+
+                        if flds != row['flds']:
+                            reindexed.append((row['id'], row['mid'], flds))
+                        if flds != row['flds'] or note_tags != row['tags']:
+                            sfld = sfld_extractor(fields[0])
+                            updates.append((flds, note_tags, sfld, _field_checksum(fields[0], sfld, sfld_extractor),
+                                            mod, row['id']))
+
+                    if updates:
+                        count += self.conn.executemany(update_sql, updates).rowcount
+
+                    # Tags are not indexed, so only the notes whose fields changed are indexed again.
+                    if self._search_ready and reindexed:
+                        with self._untracked():
+                            search_index.unindex_notes(self, [note[0] for note in reindexed])
+                            search_index.index_notes(self, reindexed)
+            finally:
+                self.conn.execute('DROP TABLE IF EXISTS temp._selected_nid')
+
+        return count
+
+    def delete_notes(self, where):
+        """Delete notes with their cards and review log. The deleted notes and cards are recorded in graves.
+
+        :param dict|list where: filters of iter_notes (deck, model, tag, since_mod, usn), or note ids.
+            where={} selects every note.
+        :return dict: number of 'notes', 'cards' and 'revlog' entries deleted
+        """
+        with self._writing():
+            self._select_notes(where)
+            try:
+                return self._delete_rows('SELECT id FROM cards WHERE nid IN (SELECT id FROM temp._selected_nid)',
+                                         'SELECT id FROM temp._selected_nid')
+            finally:
+                self.conn.execute('DROP TABLE IF EXISTS temp._selected_nid')
+
+    def delete_deck(self, name):
+        """Delete a deck, its subdecks and their cards, as well as the notes left without cards.
+        The deleted decks, notes and cards are recorded in graves.
+
+        :param str name:
+        :return dict: number of 'decks', 'notes', 'cards' and 'revlog' entries deleted
+        """
+        deck = self.get_deck(name)
+        if int(deck.id) == 1:
+            raise ValueError('The default deck cannot be deleted.')
+
+        deck_ids = [int(deck_id) for deck_name, deck_id in self._deck_ids.items()
+                    if deck_name == name or deck_name.startswith(name + '::')]
+        in_decks = '({})'.format(','.join(str(deck_id) for deck_id in deck_ids))
+
+        with self._writing():
+            result = OrderedDict([('decks', len(deck_ids))])
+            result.update(self._delete_rows(
+                'SELECT id FROM cards WHERE did IN {}'.format(in_decks),
+                'SELECT DISTINCT nid FROM cards c WHERE did IN {0} AND NOT EXISTS '
+                '(SELECT 1 FROM cards o WHERE o.nid = c.nid AND o.did NOT IN {0})'.format(in_decks)))
+
+            self.conn.executemany('INSERT INTO graves (usn, oid, type) VALUES (-1, ?, 2)',
+                                  [(deck_id, ) for deck_id in deck_ids])
+            for deck_id in deck_ids:
+                deck_name = self._decks.pop(str(deck_id))['name']
+                self._deck_ids.pop(deck_name, None)
+                self._deck_cache.pop(deck_name, None)
+            self._col_dirty = True
+
+        return result
+
+    def _select_notes(self, where):
+        """Fill temp._selected_nid with the ids of the notes matching where.
+        """
+        if where is None:
+            raise ValueError('where is required, use where={} to select every note.')
+
+        self.conn.execute('DROP TABLE IF EXISTS temp._selected_nid')
+        self.conn.execute('CREATE TEMP TABLE _selected_nid (id INTEGER PRIMARY KEY)')
+        with self._untracked():
+            if isinstance(where, dict):
+                note_where, params = self._note_filter(**where)
+                self.conn.execute('INSERT INTO temp._selected_nid SELECT id FROM notes' + note_where, params)
+            else:
+                self.conn.executemany('INSERT OR IGNORE INTO temp._selected_nid SELECT id FROM notes WHERE id = ?',
+                                      ((note_id, ) for note_id in where))
+
+    def _count_rows(self, table):
+        return self.conn.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+
+    def _delete_rows(self, card_sql, note_sql):
+        """Delete the cards and notes whose ids are selected by card_sql and note_sql, the review log
+        of the cards, and record them in graves.
+        """
+        result = OrderedDict()
+        for table in ('_deleted_cid', '_deleted_nid'):
+            self.conn.execute('DROP TABLE IF EXISTS temp.{}'.format(table))
+            self.conn.execute('CREATE TEMP TABLE {} (id INTEGER PRIMARY KEY)'.format(table))
+        try:
+            with self._untracked():
+                self.conn.execute('INSERT INTO temp._deleted_cid ' + card_sql)
+                self.conn.execute('INSERT INTO temp._deleted_nid ' + note_sql)
+
+                if self._search_ready:
+                    if self._count_rows('temp._deleted_nid') > search_index.REBUILD_THRESHOLD:
+                        self._drop_search_index()
+                    else:
+                        search_index.unindex_notes(self, [row[0] for row in
+                                                          self.conn.execute('SELECT id FROM temp._deleted_nid')])
+
+            self.conn.execute('INSERT INTO graves (usn, oid, type) SELECT -1, id, 0 FROM temp._deleted_cid')
+            self.conn.execute('INSERT INTO graves (usn, oid, type) SELECT -1, id, 1 FROM temp._deleted_nid')
+
+            result['notes'] = self.conn.execute('DELETE FROM notes WHERE id IN '
+                                                '(SELECT id FROM temp._deleted_nid)').rowcount
+            result['cards'] = self.conn.execute('DELETE FROM cards WHERE id IN '
+                                                '(SELECT id FROM temp._deleted_cid)').rowcount
+            result['revlog'] = self.conn.execute('DELETE FROM revlog WHERE cid IN '
+                                                 '(SELECT id FROM temp._deleted_cid)').rowcount
+        finally:
+            self.conn.execute('DROP TABLE temp._deleted_cid')
+            self.conn.execute('DROP TABLE temp._deleted_nid')
+
+        return result
+
+    def mark_synced(self, usn=0):
+        """Give the changes not synced yet (usn -1) an update sequence number, e.g. once they have been
+        shipped with Anki.export_delta(), so that the next delta only has the later changes.
+
+        :param int usn:
+        :return dict: number of rows marked in 'notes', 'cards', 'revlog' and 'graves'
+        """
+        result = OrderedDict()
+        with self._writing():
+            for table in ('notes', 'cards', 'revlog', 'graves'):
+                result[table] = self.conn.execute('UPDATE {} SET usn = ? WHERE usn = -1'.format(table),
+                                                  (usn, )).rowcount
+
+            for value in list(self._models.values()) + list(self._decks.values()):
+                if value.get('usn') == -1:
+                    value['usn'] = usn
+                    self._col_dirty = True
+
+        return result
+
+    def import_file(self, path, model='Basic', deck='Default', **kwargs):
+        """Import a CSV, TSV or JSON Lines file, in chunked transactions. See importer.import_file.
+
+        :return int: number of notes written
+        """
+        with self._timer('import_file') as timer:
+            count = timer.rows = import_file(self, path, model=model, deck=deck, **kwargs)
+
+        return count
+
+    def search(self, query, fields=None, deck=None, model=None, limit=None, chunk_size=1000, **kwargs):
+        """Stream the notes matching a full-text query on their fields, best match first.
+
+        The FTS5 index is built on the first search, in a temp table, so that it is never part of
+        the saved package and does not make it need saving. It is then kept up to date by add_items(),
+        update_notes() and the deletions, and built again on the next search after a merge, or after
+        updating the fields of or deleting more than search.REBUILD_THRESHOLD notes at once.
+        Changes made with other SQL are not seen by the index.
+
+        :param str query: FTS5 query, e.g. 'casa' or '"la casa" OR casita'
+        :param str|list fields: only match these fields, e.g. 'Spanish'
+        :param str deck:
+        :param str model: model name
+        :param int limit:
+        :param int chunk_size:
+        :param kwargs: other filters of iter_notes
+        :return generator: of records.AnkiNote
+        """
+        if not self._search_ready:
+            with self._untracked(), self._writing():
+                search_index.build(self, chunk_size=chunk_size)
+            self._search_ready = True
+
+        cursor = search_index.search(self, query, fields=fields, limit=limit, deck=deck, model=model, **kwargs)
+        return self._iter_note_rows(cursor, chunk_size)
+
+    def _drop_search_index(self):
+        with self._untracked():
+            search_index.drop(self)
+        self._search_ready = False
+
+    def iter_notes(self, deck=None, model=None, tag=None, since_mod=None, usn=None, chunk_size=1000):
+        """Stream notes, fetched chunk_size rows at a time.
+
+        :param str deck: only notes with a card in this deck
+        :param str model: model name
+        :param str tag:
+        :param int since_mod: only notes modified at or after this epoch second
+        :param int usn: only notes with this update sequence number, e.g. -1 for unsynced notes
+        :param int chunk_size:
+        :return generator: of records.AnkiNote
+        """
+        where, params = self._note_filter(deck=deck, model=model, tag=tag, since_mod=since_mod, usn=usn)
+        cursor = self.conn.execute('SELECT * FROM notes' + where, params)
+
+        return self._iter_note_rows(cursor, chunk_size)
+
+    def _iter_note_rows(self, cursor, chunk_size):
+        field_names = dict()
+        for rows in fetch_chunks(cursor, chunk_size):
+            for row in rows:
+                mid = row['mid']
+                if mid not in field_names:
+                    note_model = self._models.get(str(mid))
+                    field_names[mid] = (note_model['name'], [fld['name'] for fld in note_model['flds']]) \
+                        if note_model is not None else (None, [])
+
+                yield AnkiNote(row, *field_names[mid])
+
+    def count_notes(self, **kwargs):
+        """Number of notes matching the filters of iter_notes.
+        """
+        where, params = self._note_filter(**kwargs)
+        return self.conn.execute('SELECT COUNT(*) FROM notes' + where, params).fetchone()[0]
+
+    def iter_cards(self, deck=None, model=None, note=None, queue=None, since_mod=None, usn=None, chunk_size=1000):
+        """Stream cards, fetched chunk_size rows at a time.
+
+        :param str deck:
+        :param str model: model name of the note
+        :param int note: note id
+        :param int queue: see the cards table
+        :param int since_mod: only cards modified at or after this epoch second
+        :param int usn: only cards with this update sequence number
+        :param int chunk_size:
+        :return generator: of records.AnkiCard
+        """
+        where, params = self._card_filter(deck=deck, model=model, note=note, queue=queue,
+                                          since_mod=since_mod, usn=usn)
+        cursor = self.conn.execute('SELECT * FROM cards' + where, params)
+
+        for rows in fetch_chunks(cursor, chunk_size):
+            for row in rows:
+                yield AnkiCard(row)
+
+    def render_cards(self, deck=None, model=None, processes=None, chunk_size=1000, **kwargs):
+        """Stream the question and answer HTML of cards, rendered with templates compiled once per model.
+
+        :param str deck:
+        :param str model: model name of the note
+        :param int processes: render in this many worker processes, for large decks
+        :param int chunk_size: cards fetched, and sent to a worker, at a time
+        :param kwargs: other filters of iter_cards
+        :return generator: of (card id, question HTML, answer HTML)
+        """
+        return render_cards(self, processes=processes, chunk_size=chunk_size, deck=deck, model=model, **kwargs)
+
+    def count_cards(self, **kwargs):
+        """Number of cards matching the filters of iter_cards.
+        """
+        where, params = self._card_filter(**kwargs)
+        return self.conn.execute('SELECT COUNT(*) FROM cards' + where, params).fetchone()[0]
+
+    def _note_filter(self, deck=None, model=None, tag=None, since_mod=None, usn=None):
+        conditions = []
+        params = []
+
+        if deck is not None:
+            conditions.append('id IN (SELECT nid FROM cards WHERE did = ?)')
+            params.append(self.get_deck(deck).id)
+        if model is not None:
+            conditions.append('mid = ?')
+            params.append(self._model(model)['id'])
+        if tag is not None:
+            conditions.append('tags LIKE ?')
+            params.append('% {} %'.format(tag))
+        if since_mod is not None:
+            conditions.append('mod >= ?')
+            params.append(since_mod)
+        if usn is not None:
+            conditions.append('usn = ?')
+            params.append(usn)
+
+        return _where(conditions), tuple(params)
+
+    def _card_filter(self, deck=None, model=None, note=None, queue=None, since_mod=None, usn=None):
+        conditions = []
+        params = []
+
+        if deck is not None:
+            conditions.append('did = ?')
+            params.append(self.get_deck(deck).id)
+        if queue is not None:
+            conditions.append('queue = ?')
+            params.append(queue)
+        if note is not None:
+            conditions.append('nid = ?')
+            params.append(note)
+        if model is not None:
+            conditions.append('nid IN (SELECT id FROM notes WHERE mid = ?)')
+            params.append(self._model(model)['id'])
+        if since_mod is not None:
+            conditions.append('mod >= ?')
+            params.append(since_mod)
+        if usn is not None:
+            conditions.append('usn = ?')
+            params.append(usn)
+        return _where(conditions), tuple(params)
 
 
 class AnkiDeck:
@@ -418,18 +949,58 @@ class AnkiDeck:
     def add_item(self, *args, **kwargs):
         return self.anki.add_item(deck=self.name, *args, **kwargs)
 
+    def add_items(self, items, **kwargs):
+        return self.anki.add_items(items, deck=self.name, **kwargs)
+
 
 class Anki(AnkiDatabase):
-    def __init__(self, filename):
+    def __init__(self, filename, autocommit=True, sfld_extractor=None, compression=ZIP_DEFLATED, compresslevel=None,
+                 in_memory=False, instrument=False, on_operation=None, trace_sql=False):
+        """
+
+        :param str|file filename: path of the .apkg file, which is created if it does not exist,
+            or a binary file object such as BytesIO. A file object that is not seekable, such as a pipe,
+            is written once, as a new package.
+        :param bool autocommit: see AnkiDatabase
+        :param callable sfld_extractor: see AnkiDatabase
+        :param int compression: zipfile compression method of the saved package
+        :param int compresslevel: see zipfile.ZipFile
+        :param bool in_memory: open the collection as an in-memory database, instead of extracting it
+            to a temporary directory. Media added as bytes are kept in memory as well.
+        :param bool instrument: see AnkiDatabase
+        :param callable on_operation: see AnkiDatabase
+        :param bool trace_sql: see AnkiDatabase
+        """
         self.filename = filename
-        self.temp_dir = mkdtemp()
-        atexit.register(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.in_memory = in_memory
+        self._written = False
+
+        if in_memory:
+            self.temp_dir = None
+        else:
+            self.temp_dir = mkdtemp()
+            atexit.register(shutil.rmtree, self.temp_dir, ignore_errors=True)
+
+        source = filename if self._exists() else None
+        if source is not None:
+            with ZipFile(source) as zf:
+                if in_memory:
+                    conn = _deserialize(zf.read('collection.anki2'))
+                else:
+                    zf.extract('collection.anki2', path=self.temp_dir)
+        elif in_memory:
+            conn = sqlite3.connect(':memory:')
 
-        if Path(filename).exists():
-            with ZipFile(filename) as zf:
-                zf.extractall(path=self.temp_dir)
+        if not in_memory:
+            conn = sqlite3.connect(str(Path(self.temp_dir).joinpath('collection.anki2')))
 
-        super().__init__(sqlite3.connect(str(Path(self.temp_dir).joinpath('collection.anki2'))))
+        self.media = AnkiMedia(source=source, temp_dir=self.temp_dir)
+
+        super().__init__(conn, autocommit=autocommit, sfld_extractor=sfld_extractor, instrument=instrument,
+                         on_operation=on_operation, trace_sql=trace_sql)
+        self._saved_changes = self._changes()
 
     def __enter__(self):
         return self
@@ -437,11 +1008,235 @@ class Anki(AnkiDatabase):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
-    def close(self):
-        self.save()
-        shutil.rmtree(self.temp_dir)
+    def close(self, save=True):
+        if save:
+            self.save()
+        self.media.close()
+        self.conn.close()
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir)
+
+    def _is_path(self):
+        return isinstance(self.filename, (str, PurePath))
+
+    def _seekable(self):
+        return self._is_path() or self.filename.seekable()
+
+    def _exists(self):
+        if self._is_path():
+            return Path(self.filename).exists()
+        if not self._seekable():
+            # A pipe or a response body is a new package, which can only be written once.
+            return self._written
+
+        self.filename.seek(0, os.SEEK_END)
+        return self.filename.tell() > 0
+
+    def add_media(self, path_or_bytes, name=None):
+        """Add an audio or image file. Identical content is only stored once.
+
+        :param str|Path|bytes path_or_bytes:
+        :param str name: file name to reference in the fields, e.g. [sound:name] or <img src="name">
+        :return str: the file name to reference, which is the name of the existing file for duplicated content
+        """
+        return self.media.add(path_or_bytes, name=name)
+
+    def merge(self, other_apkg, on_conflict='rename'):
+        """Copy the notes, cards, review log, decks, models and media of another package into this one.
+        Pending changes are committed first, and the merge is committed as one transaction.
+
+        :param str|file other_apkg: path or file object of the other package
+        :param str on_conflict: what to do with a note whose guid already exists:
+            'rename' imports it with the next free guid, 'skip' keeps the existing note,
+            'update' overwrites the existing note if the other one is newer.
+        :return dict: numbers of 'notes' added, notes 'updated', 'cards' and 'revlog' entries added
+        """
+        if self._transaction_depth:
+            raise ValueError('Cannot merge inside a transaction.')
+        self.commit()
+
+        temp_dir = mkdtemp()
+        try:
+            with self._timer('merge') as timer, ZipFile(other_apkg) as zf:
+                zf.extract('collection.anki2', path=temp_dir)
+                result = merge_collection(self, str(Path(temp_dir).joinpath('collection.anki2')),
+                                          on_conflict=on_conflict)
+                if self._search_ready:
+                    self._drop_search_index()
+
+                other_media = AnkiMedia(source=other_apkg)
+                try:
+                    for name in other_media.names():
+                        if name not in self.media:
+                            if self.temp_dir is None:
+                                self.media.add(other_media.read(name), name=name, deduplicate=False)
+                            else:
+                                media_dir = Path(self.temp_dir).joinpath('media')
+                                media_dir.mkdir(exist_ok=True)
+                                fd, path = mkstemp(dir=str(media_dir))
+                                with other_media.open(name) as fsrc, os.fdopen(fd, 'wb') as fdst:
+                                    shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+                                self.media.add(path, name=name, deduplicate=False)
+                finally:
+                    other_media.close()
+
+                timer.rows = result['notes'] + result['updated']
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        return result
+
+    def export_delta(self, path, since=None, usn=None):
+        """Write a package of only the notes, cards, review log, deletions and media changed since
+        a modification time, or with an update sequence number. Pending changes are committed first.
+
+        :param str|file path: path or file object of the new package
+        :param int since: epoch second, see delta.export_delta
+        :param int usn: defaults to the changes not synced yet (usn -1), see mark_synced()
+        :return dict: numbers of 'notes', 'cards', 'revlog' entries, 'graves' and 'media' files exported
+        """
+        if self._transaction_depth:
+            raise ValueError('Cannot export inside a transaction.')
+        self.commit()
+
+        temp_dir = mkdtemp()
+        try:
+            with self._timer('export_delta') as timer:
+                collection = str(Path(temp_dir).joinpath('collection.anki2'))
+                result, media_names = export_delta(self, collection, since=since, usn=usn)
+                media_names = [name for name in media_names if name in self.media]
+
+                with self._timer('zip'), ZipFile(path, 'w', **self._zip_kwargs()) as zf:
+                    zf.write(collection, arcname='collection.anki2')
+                    self.media.write(zf, names=media_names)
+
+                result['media'] = len(media_names)
+                timer.rows = result['notes'] + result['cards']
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        return result
 
     def save(self):
-        with ZipFile(self.filename, 'w') as zf:
-            zf.write(str(Path(self.temp_dir).joinpath('collection.anki2')), arcname='collection.anki2')
-            zf.writestr('media', '{}')
+        """Write the package, unless nothing has changed since it was opened or last saved.
+        A package file is written to a temporary file first, which then replaces the previous one.
+
+        :return bool: whether the package was written
+        """
+        self.commit()
+
+        if self._changes() == self._saved_changes and not self.media.dirty and self._exists():
+            return False
+        if self._written and not self._seekable():
+            raise ValueError('The package was already written to a file object that is not seekable')
+
+        with self._timer('save'):
+            if self._is_path():
+                self._save_file()
+            else:
+                self._save_fileobj()
+
+        if self._seekable():
+            self.media.saved(self.filename)
+        else:
+            self.media.dirty = False
+        self._written = True
+        self._saved_changes = self._changes()
+
+        return True
+
+    def _save_file(self):
+        path = Path(self.filename).absolute()
+        # A new package gets the mode of a new file, which the kernel applies the umask to.
+        # The process umask is not read, as that means setting it, which is not thread safe.
+        while True:
+            temp_path = str(path.with_name('.{}.{}.tmp'.format(path.name, os.urandom(6).hex())))
+            try:
+                fd = os.open(temp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), 0o666)
+                break
+            except FileExistsError:
+                continue
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if path.exists():
+                    os.chmod(temp_path, os.stat(str(path)).st_mode & 0o777)
+                self._write_package(f)
+
+            self.media.close()
+            os.replace(temp_path, str(self.filename))
+        except BaseException:
+            if Path(temp_path).exists():
+                os.remove(temp_path)
+            raise
+
+    def _save_fileobj(self):
+        if self.media.source is self.filename:
+            # Media are still read from the file object, so the package is built aside first.
+            with SpooledTemporaryFile(max_size=64 * 1024 * 1024) as f:
+                self._write_package(f)
+                self.media.close()
+
+                f.seek(0)
+                self.filename.seek(0)
+                self.filename.truncate()
+                shutil.copyfileobj(f, self.filename, 1024 * 1024)
+        else:
+            if self._seekable():
+                self.filename.seek(0)
+                self.filename.truncate()
+            self._write_package(self.filename)
+
+    def _zip_kwargs(self):
+        kwargs = dict(compression=self.compression)
+        if self.compresslevel is not None:
+            kwargs['compresslevel'] = self.compresslevel
+
+        return kwargs
+
+    def _write_package(self, f):
+        with self._timer('zip'), ZipFile(f, 'w', **self._zip_kwargs()) as zf:
+            if self.in_memory:
+                zf.writestr('collection.anki2', _serialize(self.conn))
+            else:
+                zf.write(str(Path(self.temp_dir).joinpath('collection.anki2')), arcname='collection.anki2')
+            self.media.write(zf)
+
+
+def _deserialize(data):
+    """In-memory database loaded from the bytes of a database file.
+    """
+    conn = sqlite3.connect(':memory:')
+    if hasattr(conn, 'deserialize'):
+        conn.deserialize(data)
+        return conn
+
+    fd, path = mkstemp(suffix='.anki2')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        source = sqlite3.connect(path)
+        source.backup(conn)
+        source.close()
+    finally:
+        os.remove(path)
+
+    return conn
+
+
+def _serialize(conn):
+    """Bytes of the database file of a connection.
+    """
+    if hasattr(conn, 'serialize'):
+        return conn.serialize()
+
+    fd, path = mkstemp(suffix='.anki2')
+    os.close(fd)
+    try:
+        target = sqlite3.connect(path)
+        conn.backup(target)
+        target.close()
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
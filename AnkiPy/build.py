@@ -0,0 +1,107 @@
+import os
+from collections import OrderedDict
+from time import perf_counter
+import traceback
+
+from .app import Anki
+
+
+class BuildResult:
+    __slots__ = ('path', 'ok', 'notes', 'seconds', 'error')
+
+    def __init__(self, path, ok, notes=0, seconds=0.0, error=None):
+        """
+
+        :param str path: output path of the package
+        :param bool ok:
+        :param int notes: number of notes written
+        :param float seconds:
+        :param str error: formatted traceback, if the build failed
+        """
+        self.path = path
+        self.ok = ok
+        self.notes = notes
+        self.seconds = seconds
+        self.error = error
+
+    def __repr__(self):
+        return '<BuildResult {} {}>'.format(self.path, 'ok' if self.ok else 'failed')
+
+
+def build_packages(specs, workers=None, on_progress=None):
+    """Build independent packages in parallel, in a pool of processes.
+
+    Each spec is a dict with:
+
+    - 'path': output path of the package
+    - 'models': optional list of keyword arguments of Anki.new_model
+    - 'decks': list of dicts with 'name', optional 'model' and 'tags', and 'notes', which are given to
+      AnkiDeck.add_items. 'notes' is a list, or a picklable callable returning an iterable (e.g. a generator
+      function), so that notes are generated in the worker process.
+
+    Other keys are passed to Anki(), with autocommit=False unless given. A failing package is not written,
+    and does not stop the others.
+
+    :param list specs:
+    :param int workers: number of processes, defaults to the number of CPUs
+    :param callable on_progress: called in the calling process with each BuildResult, as soon as it is done
+    :return list: BuildResult of each spec, in the same order
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    specs = list(specs)
+    results = [None] * len(specs)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = dict((executor.submit(build_package, spec), i) for i, spec in enumerate(specs))
+
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                result = BuildResult(specs[i].get('path'), False, error=traceback.format_exc())
+
+            results[i] = result
+            if on_progress is not None:
+                on_progress(result)
+
+    return results
+
+
+def build_package(spec):
+    """Build one package of build_packages. On an error, the package is not written.
+
+    :param dict spec:
+    :return BuildResult:
+    """
+    start = perf_counter()
+    spec = OrderedDict(spec)
+    path = spec.pop('path', None)
+    models = spec.pop('models', [])
+    decks = spec.pop('decks', [])
+    spec.setdefault('autocommit', False)
+
+    notes = 0
+    try:
+        anki = Anki(path, **spec)
+        try:
+            for model in models:
+                anki.new_model(**model)
+
+            for deck in decks:
+                deck = dict(deck)
+                items = deck.pop('notes')
+                if callable(items):
+                    items = items()
+
+                notes += anki.deck(deck.pop('name')).add_items(items, **deck)
+        except BaseException:
+            anki.close(save=False)
+            raise
+
+        anki.close()
+    except Exception:
+        return BuildResult(path, False, notes=notes, seconds=perf_counter() - start, error=traceback.format_exc())
+
+    return BuildResult(path, True, notes=notes, seconds=perf_counter() - start)
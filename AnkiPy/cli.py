@@ -0,0 +1,69 @@
+import argparse
+import sys
+
+from .app import Anki
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='ankipy', description='Create Anki packages.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    import_parser = subparsers.add_parser('import', help='import a CSV, TSV or JSON Lines file into a package')
+    import_parser.add_argument('source', help='CSV, TSV or JSON Lines file')
+    import_parser.add_argument('package', help='.apkg file, which is created if it does not exist')
+    import_parser.add_argument('--model', default='Basic', help='model name, created from the columns if needed')
+    import_parser.add_argument('--deck', default='Default', help='deck of the rows without a deck column')
+    import_parser.add_argument('--columns', nargs='+', help='column of each field of the model')
+    import_parser.add_argument('--tags-column', default='tags')
+    import_parser.add_argument('--deck-column', default='deck')
+    import_parser.add_argument('--format', dest='file_format', choices=('csv', 'tsv', 'jsonl'))
+    import_parser.add_argument('--delimiter')
+    import_parser.add_argument('--no-header', dest='header', action='store_false',
+                               help='the first row is not the column names; columns are then indices')
+    import_parser.add_argument('--encoding', default='utf8')
+    import_parser.add_argument('--chunk-size', type=int, default=10000, help='rows per transaction')
+    import_parser.add_argument('--on-duplicate', default='allow', choices=('allow', 'skip', 'update', 'error'))
+    import_parser.add_argument('--quiet', action='store_true', help='do not report progress')
+
+    args = parser.parse_args(argv)
+    if args.command == 'import':
+        return _import(args)
+
+    parser.print_help()
+    return 1
+
+
+def _import(args):
+    columns = args.columns
+    if columns is not None and not args.header:
+        columns = [int(column) for column in columns]
+    tags_column = args.tags_column if args.header else _int_or_none(args.tags_column)
+    deck_column = args.deck_column if args.header else _int_or_none(args.deck_column)
+
+    def on_progress(rows, seconds):
+        if not args.quiet:
+            sys.stderr.write('\r{} rows, {:.0f} rows/s'.format(rows, rows / seconds if seconds else 0))
+            sys.stderr.flush()
+
+    with Anki(args.package) as anki:
+        count = anki.import_file(args.source, model=args.model, deck=args.deck, columns=columns,
+                                 tags_column=tags_column, deck_column=deck_column, file_format=args.file_format,
+                                 delimiter=args.delimiter, header=args.header, encoding=args.encoding,
+                                 chunk_size=args.chunk_size, on_duplicate=args.on_duplicate,
+                                 on_progress=on_progress)
+
+    if not args.quiet:
+        sys.stderr.write('\n{} notes written to {}\n'.format(count, args.package))
+
+    return 0
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+if __name__ == '__main__':
+    sys.exit(main())
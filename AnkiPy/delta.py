@@ -0,0 +1,126 @@
+import json
+import re
+import sqlite3
+from collections import OrderedDict
+from itertools import count
+from time import time
+
+from .tools.chunks import fetch_chunks
+from .tools.defaults import DEFAULTS
+from .tools.schema import SCHEMA
+
+_aliases = count()
+
+_MEDIA_RE = re.compile(r'\[sound:(.+?)\]|<img[^>]*?\ssrc\s*=\s*(?:"([^"]+)"|\'([^\']+)\'|([^\s>]+))',
+                       flags=re.IGNORECASE)
+
+
+def export_delta(anki, path, since=None, usn=None):
+    """Copy the notes, cards, review log entries and graves changed since a modification time, or with
+    an update sequence number, into a new collection. Rows are selected through the usn indexes of Anki,
+    or by one scan of the notes and cards for since, as the schema of the collection is left as it is.
+
+    The notes of the changed cards are included, as well as the models and decks that are used
+    or have changed.
+
+    :param AnkiDatabase anki:
+    :param str path: path of the new collection.anki2
+    :param int since: only rows modified at or after this epoch second. Graves have no modification time,
+        so those not synced yet (usn -1) are included.
+    :param int usn: only rows with this update sequence number. If neither since nor usn is given,
+        rows not synced yet (usn -1) are exported.
+    :return tuple: dict of the numbers of 'notes', 'cards', 'revlog' entries and 'graves' exported,
+        and list of the media file names referenced by the exported notes
+    """
+    if since is None and usn is None:
+        usn = -1
+
+    target = sqlite3.connect(str(path))
+    target.executescript(SCHEMA)
+    target.close()
+
+    conn = anki.conn
+    alias = 'delta{}'.format(next(_aliases))
+    conn.execute('ATTACH DATABASE ? AS {}'.format(alias), (str(path), ))
+    try:
+        with anki.transaction():
+            result = _copy_rows(conn, alias, since, usn)
+            _write_col(anki, alias, since, usn)
+
+            media_names = OrderedDict()
+            cursor = conn.execute('SELECT flds FROM {}.notes'.format(alias))
+            for rows in fetch_chunks(cursor, 1000):
+                for row in rows:
+                    for match in _MEDIA_RE.finditer(row[0]):
+                        media_names[next(name for name in match.groups() if name is not None)] = None
+    finally:
+        conn.execute('DETACH DATABASE {}'.format(alias))
+
+    return result, list(media_names.keys())
+
+
+def _filter(since, usn, mod_column='mod'):
+    conditions = []
+    params = []
+    if since is not None:
+        conditions.append('{} >= ?'.format(mod_column))
+        params.append(since)
+    if usn is not None:
+        conditions.append('usn = ?')
+        params.append(usn)
+
+    return ' AND '.join(conditions), tuple(params)
+
+
+def _copy_rows(conn, alias, since, usn):
+    result = OrderedDict([('notes', 0), ('cards', 0), ('revlog', 0), ('graves', 0)])
+    note_columns = ','.join(DEFAULTS['notes'].keys())
+    card_columns = ','.join(DEFAULTS['cards'].keys())
+
+    where, params = _filter(since, usn)
+    result['cards'] = conn.execute('INSERT INTO {0}.cards ({1}) SELECT {1} FROM main.cards WHERE {2}'
+                                   .format(alias, card_columns, where), params).rowcount
+    result['notes'] = conn.execute('INSERT INTO {0}.notes ({1}) SELECT {1} FROM main.notes WHERE {2}'
+                                   .format(alias, note_columns, where), params).rowcount
+    result['notes'] += conn.execute('INSERT OR IGNORE INTO {0}.notes ({1}) SELECT {1} FROM main.notes '
+                                    'WHERE id IN (SELECT nid FROM {0}.cards)'
+                                    .format(alias, note_columns)).rowcount
+
+    # Review log ids are epoch milliseconds.
+    where, params = _filter(None if since is None else since * 1000, usn, mod_column='id')
+    result['revlog'] = conn.execute('INSERT INTO {0}.revlog SELECT * FROM main.revlog WHERE {1}'
+                                    .format(alias, where), params).rowcount
+
+    where, params = _filter(None, -1 if usn is None else usn)
+    result['graves'] = conn.execute('INSERT INTO {0}.graves (usn, oid, type) SELECT usn, oid, type '
+                                    'FROM main.graves WHERE {1}'.format(alias, where), params).rowcount
+
+    return result
+
+
+def _write_col(anki, alias, since, usn):
+    conn = anki.conn
+
+    def changed(value):
+        return (since is None or value.get('mod', 0) >= since) and (usn is None or value.get('usn') == usn)
+
+    mids = set(row[0] for row in conn.execute('SELECT DISTINCT mid FROM {}.notes'.format(alias)))
+    models = OrderedDict((k, v) for k, v in anki._models.items() if int(k) in mids or changed(v))
+
+    dids = set(row[0] for row in conn.execute('SELECT did FROM {0}.cards UNION SELECT odid FROM {0}.cards'
+                                              .format(alias)))
+    decks = OrderedDict((k, v) for k, v in anki._decks.items() if int(k) in dids or k == '1' or changed(v))
+
+    conf_ids = set(str(deck.get('conf')) for deck in decks.values()) | {'1'}
+    dconf = OrderedDict((k, v) for k, v in anki._dconf.items() if k in conf_ids)
+
+    col = OrderedDict(conn.execute('SELECT * FROM main.col').fetchone())
+    col.update({
+        'mod': int(time() * 1000),
+        'models': json.dumps(models),
+        'decks': json.dumps(decks),
+        'dconf': json.dumps(dconf)
+    })
+    conn.execute('INSERT INTO {}.col ({}) VALUES ({})'.format(alias, ','.join(col.keys()),
+                                                              ','.join('?' for _ in col.keys())),
+                 tuple(col.values()))
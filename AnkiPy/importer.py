@@ -0,0 +1,132 @@
+import csv
+import json
+from itertools import chain
+from pathlib import Path
+from time import perf_counter
+
+from .tools.chunks import chunks
+
+FORMATS = {
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.txt': 'tsv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl'
+}
+
+
+def import_file(anki, path, model='Basic', deck='Default', columns=None, tags_column='tags', deck_column='deck',
+                file_format=None, delimiter=None, header=True, encoding='utf8', chunk_size=10000,
+                on_duplicate='allow', on_progress=None):
+    """Stream rows of a CSV, TSV or JSON Lines file into notes, committing every chunk_size rows.
+
+    :param AnkiDatabase anki:
+    :param str path:
+    :param str model: model name. If it does not exist, it is created with the field columns as fields.
+    :param str deck: deck of the rows without a deck column
+    :param list columns: column of each field of the model, by name (or by index, without header).
+        Defaults to the columns named after the fields of the model, or to the columns other than
+        tags_column and deck_column if the model does not exist. Every column must be in the header,
+        or in the first row of a JSON Lines file.
+    :param str|int tags_column: column of space-separated tags, if present
+    :param str|int deck_column: column of deck names, if present
+    :param str file_format: 'csv', 'tsv' or 'jsonl'. Defaults to the one of the file extension.
+    :param str delimiter: CSV delimiter, overriding the one of the format
+    :param bool header: whether the first row of a CSV or TSV file is the column names
+    :param str encoding:
+    :param int chunk_size: rows per transaction
+    :param str on_duplicate: see AnkiDatabase.add_items
+    :param callable on_progress: called after each chunk with the number of rows done and the elapsed seconds
+    :return int: number of notes written
+    """
+    if file_format is None:
+        file_format = FORMATS.get(Path(path).suffix.lower())
+        if file_format is None:
+            raise ValueError('Cannot guess the format of {}'.format(path))
+
+    with open(str(path), newline='', encoding=encoding) as f:
+        rows = _read_rows(f, file_format, delimiter, header)
+
+        first = next(rows, None)
+        if first is None:
+            return 0
+        rows = chain([first], rows)
+
+        if columns is None:
+            try:
+                columns = [fld['name'] for fld in anki._model(model)['flds']]
+            except ValueError:
+                if not isinstance(first, dict):
+                    raise
+                columns = [k for k in first.keys() if k not in (tags_column, deck_column)]
+
+        if isinstance(first, dict):
+            missing = [column for column in columns if column not in first]
+        else:
+            missing = [column for column in columns if not isinstance(column, int) or column >= len(first)]
+        if missing:
+            raise ValueError('Columns not found in {}: {}'.format(path, ', '.join(str(c) for c in missing)))
+
+        try:
+            anki._model(model)
+        except ValueError:
+            anki.new_model(name=model, fields=[str(column) for column in columns])
+
+        def items():
+            for row in rows:
+                item = {'fields': [_text(_get(row, column)) for column in columns]}
+                row_tags = _get(row, tags_column)
+                if row_tags is not None:
+                    item['tags'] = row_tags
+                item['deck'] = _get(row, deck_column) or None
+
+                yield item
+
+        count = 0
+        done = 0
+        start = perf_counter()
+        for chunk in chunks(items(), chunk_size):
+            with anki.transaction():
+                count += anki.add_items(chunk, deck=deck, model=model, chunk_size=chunk_size,
+                                        on_duplicate=on_duplicate)
+            done += len(chunk)
+            if on_progress is not None:
+                on_progress(done, perf_counter() - start)
+
+    return count
+
+
+def _get(row, column):
+    if isinstance(row, dict):
+        return row.get(column)
+    if isinstance(column, int) and column < len(row):
+        return row[column]
+
+    return None
+
+
+def _text(value):
+    if value is None:
+        return ''
+
+    return str(value)
+
+
+def _read_rows(f, file_format, delimiter, header):
+    if file_format == 'jsonl':
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    elif file_format in ('csv', 'tsv'):
+        if delimiter is None:
+            delimiter = ',' if file_format == 'csv' else '\t'
+
+        if header:
+            for row in csv.DictReader(f, delimiter=delimiter):
+                yield row
+        else:
+            for row in csv.reader(f, delimiter=delimiter):
+                yield row
+    else:
+        raise ValueError('Invalid format: {}'.format(file_format))
+
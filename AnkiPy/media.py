@@ -0,0 +1,327 @@
+import json
+import shutil
+from collections import OrderedDict
+from hashlib import sha1
+from io import BytesIO
+from pathlib import Path
+import struct
+import zipfile
+from zipfile import ZipFile, ZipInfo
+from zlib import crc32
+
+_BLOCK_SIZE = 1024 * 1024
+
+# Internals of zipfile used by _copy_compressed(), which are not part of its API.
+_ZIPFILE_NAMES = ('structFileHeader', 'sizeFileHeader', '_FH_FILENAME_LENGTH', '_FH_EXTRA_FIELD_LENGTH')
+_READER_ATTRS = ('_lock', 'fp')
+_WRITER_ATTRS = ('_lock', 'fp', '_writecheck', '_didModify', '_writing', 'start_dir', 'filelist', 'NameToInfo')
+
+
+class AnkiMediaFile:
+    __slots__ = ('name', 'path', 'member', 'data', 'size', 'crc', 'sha1')
+
+    def __init__(self, name, path=None, member=None, data=None, size=None, crc=None, sha1=None):
+        """One of path (a file on disk), member (an entry of the source package) or data is set.
+
+        :param str name: file name, as referenced in the fields
+        :param str path:
+        :param str member:
+        :param bytes data:
+        :param int size:
+        :param int crc: CRC-32 of the content
+        :param str sha1: hex digest of the content, None until known
+        """
+        self.name = name
+        self.path = path
+        self.member = member
+        self.data = data
+        self.size = size
+        self.crc = crc
+        self.sha1 = sha1
+
+
+class AnkiMedia:
+    def __init__(self, source=None, temp_dir=None):
+        """Media of a package. Files are read from the source package or from disk only when needed,
+        and streamed into the zip when saving.
+
+        :param str|file source: path or file object of an existing package
+        :param str temp_dir: directory where media added as bytes are written to.
+            If None, they are kept in memory.
+        """
+        self.source = source
+        self.temp_dir = temp_dir
+        self.dirty = False
+
+        self._files = OrderedDict()
+        self._hashes = dict()
+        self._unhashed = dict()
+        self._source_zf = None
+
+        if source is not None:
+            self._load(source)
+
+    def _load(self, source):
+        self.close()
+        self.source = source
+        self._files = OrderedDict()
+        self._hashes = dict()
+        self._unhashed = dict()
+
+        with ZipFile(source) as zf:
+            try:
+                media = json.loads(zf.read('media').decode('utf8') or '{}')
+            except KeyError:
+                media = dict()
+
+            for member, name in media.items():
+                try:
+                    info = zf.getinfo(member)
+                except KeyError:
+                    continue
+
+                self._register(AnkiMediaFile(name, member=member, size=info.file_size, crc=info.CRC))
+
+    def _register(self, media_file):
+        self._files[media_file.name] = media_file
+        if media_file.sha1 is not None:
+            self._hashes[media_file.sha1] = media_file.name
+        else:
+            self._unhashed.setdefault((media_file.size, media_file.crc), []).append(media_file.name)
+
+    def _unregister(self, name):
+        media_file = self._files.pop(name)
+        if media_file.sha1 is not None:
+            self._hashes.pop(media_file.sha1, None)
+        else:
+            self._unhashed[(media_file.size, media_file.crc)].remove(name)
+
+    def add(self, path_or_bytes, name=None, deduplicate=True):
+        """Add a media file, unless the same content is already there.
+
+        :param str|Path|bytes path_or_bytes:
+        :param str name: file name to reference in the fields. Defaults to the file name of the path,
+            or to the sha1 of the content. An existing file of the same name is replaced.
+        :param bool deduplicate: if False, the file is added under its name even if the content is already there
+        :return str: the name to reference in the fields, which is the name of the existing file
+            if the content is a duplicate.
+        """
+        if isinstance(path_or_bytes, (bytes, bytearray)):
+            digest = sha1(path_or_bytes).hexdigest()
+            crc = crc32(path_or_bytes)
+            size = len(path_or_bytes)
+            path = None
+            if name is None:
+                name = digest
+        else:
+            path = str(path_or_bytes)
+            digest, crc, size = _hash_stream(Path(path).open('rb'))
+            if name is None:
+                name = Path(path).name
+
+        if deduplicate:
+            existing = self._find(digest, size, crc)
+            if existing is not None:
+                return existing
+
+        data = None
+        if path is None:
+            if self.temp_dir is None or not deduplicate:
+                data = bytes(path_or_bytes)
+            else:
+                media_dir = Path(self.temp_dir).joinpath('media')
+                media_dir.mkdir(exist_ok=True)
+                path = str(media_dir.joinpath(digest))
+                with open(path, 'wb') as f:
+                    f.write(path_or_bytes)
+
+        if name in self._files:
+            self._unregister(name)
+
+        self._register(AnkiMediaFile(name, path=path, data=data, size=size, crc=crc, sha1=digest))
+        self.dirty = True
+
+        return name
+
+    def _find(self, digest, size, crc):
+        name = self._hashes.get(digest)
+        if name is not None:
+            return name
+
+        for name in list(self._unhashed.get((size, crc), [])):
+            media_file = self._files[name]
+            with self.open(name) as f:
+                media_file.sha1 = _hash_stream(f)[0]
+
+            self._unhashed[(size, crc)].remove(name)
+            self._hashes[media_file.sha1] = name
+            if media_file.sha1 == digest:
+                return name
+
+        return None
+
+    def open(self, name):
+        """
+
+        :param str name:
+        :return: binary file object
+        """
+        media_file = self._files[name]
+        if media_file.path is not None:
+            return open(media_file.path, 'rb')
+        if media_file.data is not None:
+            return BytesIO(media_file.data)
+
+        return self._source_zip().open(media_file.member)
+
+    def _source_zip(self):
+        if self._source_zf is None:
+            self._source_zf = ZipFile(self.source)
+
+        return self._source_zf
+
+    def close(self):
+        if self._source_zf is not None:
+            self._source_zf.close()
+            self._source_zf = None
+
+    def read(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def names(self):
+        return list(self._files.keys())
+
+    def __contains__(self, name):
+        return name in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def write(self, zf, names=None):
+        """Stream every media file into zf, under Anki's numbered names, followed by the media map.
+
+        :param ZipFile zf:
+        :param list names: only write these files
+        """
+        if names is None:
+            media_files = self._files.values()
+        else:
+            media_files = [self._files[name] for name in names]
+
+        media = OrderedDict()
+        for i, media_file in enumerate(media_files):
+            member = str(i)
+            if media_file.path is not None:
+                zf.write(media_file.path, arcname=member)
+            elif media_file.data is not None:
+                zf.writestr(member, media_file.data)
+            else:
+                source = self._source_zip()
+                source_info = source.getinfo(media_file.member)
+                if source_info.compress_type == zf.compression and not source_info.flag_bits & 0x1 \
+                        and _can_copy_compressed(source, zf):
+                    _copy_compressed(source, source_info, zf, member)
+                else:
+                    info = ZipInfo(member, date_time=source_info.date_time)
+                    info.compress_type = zf.compression
+                    info.file_size = media_file.size
+                    # Public since Python 3.13
+                    if hasattr(info, 'compress_level'):
+                        info.compress_level = getattr(zf, 'compresslevel', None)
+                    else:
+                        info._compresslevel = getattr(zf, 'compresslevel', None)
+                    with source.open(media_file.member) as fsrc, zf.open(info, 'w') as fdst:
+                        shutil.copyfileobj(fsrc, fdst, _BLOCK_SIZE)
+
+            media[member] = media_file.name
+
+        zf.writestr('media', json.dumps(media))
+
+    def saved(self, source):
+        """Read the media from the newly saved package from now on, and discard the files added as bytes.
+
+        :param str|file source: path or file object of the saved package
+        """
+        digests = dict((media_file.name, media_file.sha1) for media_file in self._files.values()
+                       if media_file.sha1 is not None)
+
+        self._load(source)
+        for name, digest in digests.items():
+            media_file = self._files[name]
+            self._unhashed[(media_file.size, media_file.crc)].remove(name)
+            media_file.sha1 = digest
+            self._hashes[digest] = name
+
+        if self.temp_dir is not None:
+            shutil.rmtree(str(Path(self.temp_dir).joinpath('media')), ignore_errors=True)
+
+        self.dirty = False
+
+
+def _hash_stream(f):
+    h = sha1()
+    crc = 0
+    size = 0
+    with f:
+        while True:
+            block = f.read(_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+            crc = crc32(block, crc)
+            size += len(block)
+
+    return h.hexdigest(), crc, size
+
+
+def _can_copy_compressed(source, zf):
+    """Whether this zipfile has the internals used by _copy_compressed(), and zf has no open writing handle.
+    Otherwise, members are decompressed and compressed again.
+    """
+    return all(hasattr(zipfile, name) for name in _ZIPFILE_NAMES) \
+        and all(hasattr(source, name) for name in _READER_ATTRS) \
+        and all(hasattr(zf, name) for name in _WRITER_ATTRS) \
+        and hasattr(ZipInfo, 'FileHeader') and not zf._writing
+
+
+def _copy_compressed(source, source_info, zf, arcname):
+    """Copy a member of source into zf as it is stored, without decompressing and compressing it again.
+    It writes through internals of zipfile, so check _can_copy_compressed() first.
+
+    :param ZipFile source:
+    :param ZipInfo source_info:
+    :param ZipFile zf: opened for writing
+    :param str arcname:
+    """
+    info = ZipInfo(arcname, date_time=source_info.date_time)
+    info.compress_type = source_info.compress_type
+    info.CRC = source_info.CRC
+    info.compress_size = source_info.compress_size
+    info.file_size = source_info.file_size
+    info.external_attr = source_info.external_attr
+    info.flag_bits = source_info.flag_bits & ~0x08
+
+    with source._lock:
+        source.fp.seek(source_info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, source.fp.read(zipfile.sizeFileHeader))
+        source.fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+        with zf._lock:
+            zf._writecheck(info)
+            zf._didModify = True
+            zf.fp.seek(zf.start_dir)
+            info.header_offset = zf.fp.tell()
+            zf.fp.write(info.FileHeader())
+
+            remaining = info.compress_size
+            while remaining > 0:
+                block = source.fp.read(min(_BLOCK_SIZE, remaining))
+                if not block:
+                    raise zipfile.BadZipFile('Truncated member {}'.format(source_info.filename))
+                zf.fp.write(block)
+                remaining -= len(block)
+
+            zf.filelist.append(info)
+            zf.NameToInfo[info.filename] = info
+            zf.start_dir = zf.fp.tell()
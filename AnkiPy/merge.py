@@ -0,0 +1,223 @@
+import json
+from collections import OrderedDict
+from copy import deepcopy
+from itertools import count
+
+from .tools.guid import incGuid
+
+_aliases = count()
+
+
+def merge_collection(anki, path, on_conflict='rename'):
+    """Copy the notes, cards and review log of another collection into anki, with set-based SQL.
+
+    Decks are matched by name, and models by name and field names. Colliding note, card and revlog ids
+    are given new ids.
+
+    :param AnkiDatabase anki:
+    :param str path: path of the other collection.anki2
+    :param str on_conflict: what to do with a note whose guid already exists:
+        'rename' imports it with the next free guid (tools.guid.incGuid),
+        'skip' leaves the existing note, 'update' overwrites the existing note if the other one is newer.
+    :return dict: numbers of 'notes' added, notes 'updated', 'cards' and 'revlog' entries added
+    """
+    if on_conflict not in ('rename', 'skip', 'update'):
+        raise ValueError('Invalid on_conflict: {}'.format(on_conflict))
+
+    conn = anki.conn
+    alias = 'merge{}'.format(next(_aliases))
+    conn.execute('ATTACH DATABASE ? AS {}'.format(alias), (str(path), ))
+    try:
+        with anki.transaction():
+            other = conn.execute('SELECT decks, models, dconf FROM {}.col'.format(alias)).fetchone()
+            mid_map = _merge_models(anki, json.loads(other['models'], object_pairs_hook=OrderedDict))
+            did_map = _merge_decks(anki, json.loads(other['decks'], object_pairs_hook=OrderedDict),
+                                   json.loads(other['dconf'], object_pairs_hook=OrderedDict))
+            anki._col_dirty = True
+
+            result = _merge_rows(anki, alias, mid_map, did_map, on_conflict)
+    finally:
+        # Kept ids may be greater than the last allocated ones, so allocation is seeded again from max(id).
+        anki._last_id.pop('nid', None)
+        anki._last_id.pop('cid', None)
+
+        for table in ('mid', 'did', 'nid', 'cid', 'rid', 'update'):
+            conn.execute('DROP TABLE IF EXISTS temp._merge_{}'.format(table))
+        conn.execute('DETACH DATABASE {}'.format(alias))
+
+    return result
+
+
+def _merge_models(anki, models):
+    mid_map = dict()
+    for model_id, model in models.items():
+        existing_id = anki._model_ids.get(model['name'])
+        if existing_id is not None:
+            existing = anki._models[existing_id]
+            if [fld['name'] for fld in existing['flds']] == [fld['name'] for fld in model['flds']] \
+                    and len(existing['tmpls']) == len(model['tmpls']):
+                mid_map[int(model_id)] = existing['id']
+                continue
+
+        model = deepcopy(model)
+        name = model['name']
+        i = 1
+        while name in anki._model_ids:
+            i += 1
+            name = '{}-{}'.format(model['name'], i)
+        model['name'] = name
+
+        if model_id in anki._models:
+            model['id'] = anki._new_id('mid')
+        model['usn'] = -1
+
+        anki._models[str(model['id'])] = model
+        anki._model_ids[name] = str(model['id'])
+        mid_map[int(model_id)] = model['id']
+
+    return mid_map
+
+
+def _merge_decks(anki, decks, dconf):
+    did_map = dict()
+    for deck_id, deck in decks.items():
+        existing_id = anki._deck_ids.get(deck['name'])
+        if existing_id is not None:
+            did_map[int(deck_id)] = int(existing_id)
+            continue
+
+        deck = deepcopy(deck)
+        if deck_id in anki._decks:
+            deck['id'] = anki._new_id('did')
+        deck['usn'] = -1
+
+        conf_id = str(deck.get('conf', ''))
+        if conf_id in dconf and conf_id not in anki._dconf:
+            anki._dconf[conf_id] = dconf[conf_id]
+
+        anki._decks[str(deck['id'])] = deck
+        anki._deck_ids[deck['name']] = str(deck['id'])
+        did_map[int(deck_id)] = deck['id']
+
+    return did_map
+
+
+def _merge_rows(anki, alias, mid_map, did_map, on_conflict):
+    conn = anki.conn
+    conn.create_function('inc_guid', 1, incGuid)
+    result = OrderedDict([('notes', 0), ('updated', 0), ('cards', 0), ('revlog', 0)])
+
+    conn.execute('CREATE TEMP TABLE _merge_mid (old INTEGER PRIMARY KEY, new INTEGER)')
+    conn.executemany('INSERT INTO temp._merge_mid VALUES (?, ?)', mid_map.items())
+    conn.execute('CREATE TEMP TABLE _merge_did (old INTEGER PRIMARY KEY, new INTEGER)')
+    conn.executemany('INSERT INTO temp._merge_did VALUES (?, ?)', did_map.items())
+
+    if on_conflict == 'update':
+        conn.execute('''
+CREATE TEMP TABLE _merge_update AS
+SELECT n.id AS nid, o.tags, o.flds, o.sfld, o.csum, o.mod
+FROM {0}.notes o
+JOIN main.notes n ON n.guid = o.guid
+JOIN temp._merge_mid m ON m.old = o.mid
+WHERE o.mod > n.mod AND n.mid = m.new'''.format(alias))
+        result['updated'] = conn.execute('''
+UPDATE main.notes SET (tags, flds, sfld, csum, mod, usn) =
+    (SELECT u.tags, u.flds, u.sfld, u.csum, u.mod, -1 FROM temp._merge_update u WHERE u.nid = notes.id)
+WHERE id IN (SELECT nid FROM temp._merge_update)''').rowcount
+
+    if on_conflict == 'rename':
+        selected = ''
+    else:
+        selected = 'AND guid NOT IN (SELECT guid FROM main.notes)'
+
+    # Ids that are free are kept, the others are numbered after every id of both collections.
+    conn.execute('CREATE TEMP TABLE _merge_nid (new INTEGER PRIMARY KEY, old INTEGER UNIQUE, guid TEXT, '
+                 'original_guid TEXT)')
+    conn.execute('''
+INSERT INTO temp._merge_nid (new, old, guid, original_guid)
+SELECT id, id, guid, guid FROM {0}.notes
+WHERE id NOT IN (SELECT id FROM main.notes) {1}'''.format(alias, selected))
+    _insert_renumbered(conn, '''
+INSERT INTO temp._merge_nid (old, guid, original_guid)
+SELECT id, guid, guid FROM {0}.notes
+WHERE id IN (SELECT id FROM main.notes) {1}'''.format(alias, selected),
+                       'SELECT max(id) FROM main.notes', 'SELECT max(id) FROM {}.notes'.format(alias))
+
+    if on_conflict == 'rename':
+        # A guid is incremented while it is in the collection, or another incoming note has it and comes first:
+        # notes keeping their own guid, then by id.
+        conn.execute('CREATE INDEX temp._merge_nid_guid ON _merge_nid (guid)')
+        while conn.execute('''
+UPDATE temp._merge_nid SET guid = inc_guid(guid)
+WHERE guid IN (SELECT guid FROM main.notes)
+    OR (guid != original_guid AND guid IN (SELECT original_guid FROM temp._merge_nid))
+    OR EXISTS (SELECT 1 FROM temp._merge_nid o WHERE o.guid = _merge_nid.guid AND o.new != _merge_nid.new
+               AND ((o.guid = o.original_guid) > (_merge_nid.guid = _merge_nid.original_guid)
+                    OR ((o.guid = o.original_guid) = (_merge_nid.guid = _merge_nid.original_guid)
+                        AND o.new < _merge_nid.new)))''').rowcount:
+            pass
+
+    result['notes'] = conn.execute('''
+INSERT INTO main.notes (id, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data)
+SELECT m.new, m.guid, mm.new, o.mod, -1, o.tags, o.flds, o.sfld, o.csum, o.flags, o.data
+FROM {0}.notes o
+JOIN temp._merge_nid m ON m.old = o.id
+JOIN temp._merge_mid mm ON mm.old = o.mid'''.format(alias)).rowcount
+
+    conn.execute('CREATE TEMP TABLE _merge_cid (new INTEGER PRIMARY KEY, old INTEGER UNIQUE)')
+    conn.execute('''
+INSERT INTO temp._merge_cid (new, old)
+SELECT id, id FROM {0}.cards
+WHERE nid IN (SELECT old FROM temp._merge_nid) AND id NOT IN (SELECT id FROM main.cards)'''.format(alias))
+    _insert_renumbered(conn, '''
+INSERT INTO temp._merge_cid (old)
+SELECT id FROM {0}.cards
+WHERE nid IN (SELECT old FROM temp._merge_nid) AND id IN (SELECT id FROM main.cards)'''.format(alias),
+                       'SELECT max(id) FROM main.cards', 'SELECT max(id) FROM {}.cards'.format(alias))
+
+    result['cards'] = conn.execute('''
+INSERT INTO main.cards (id, nid, did, ord, mod, usn, type, queue, due, ivl, factor, reps, lapses, left,
+                        odue, odid, flags, data)
+SELECT m.new, n.new, COALESCE(d.new, c.did), c.ord, c.mod, -1, c.type, c.queue, c.due, c.ivl, c.factor,
+       c.reps, c.lapses, c.left, c.odue, COALESCE(od.new, c.odid), c.flags, c.data
+FROM {0}.cards c
+JOIN temp._merge_cid m ON m.old = c.id
+JOIN temp._merge_nid n ON n.old = c.nid
+LEFT JOIN temp._merge_did d ON d.old = c.did
+LEFT JOIN temp._merge_did od ON od.old = c.odid'''.format(alias)).rowcount
+
+    conn.execute('CREATE TEMP TABLE _merge_rid (new INTEGER PRIMARY KEY, old INTEGER UNIQUE)')
+    conn.execute('''
+INSERT INTO temp._merge_rid (new, old)
+SELECT id, id FROM {0}.revlog
+WHERE cid IN (SELECT old FROM temp._merge_cid) AND id NOT IN (SELECT id FROM main.revlog)'''.format(alias))
+    _insert_renumbered(conn, '''
+INSERT INTO temp._merge_rid (old)
+SELECT id FROM {0}.revlog
+WHERE cid IN (SELECT old FROM temp._merge_cid) AND id IN (SELECT id FROM main.revlog)'''.format(alias),
+                       'SELECT max(id) FROM main.revlog', 'SELECT max(id) FROM {}.revlog'.format(alias))
+
+    result['revlog'] = conn.execute('''
+INSERT INTO main.revlog (id, cid, usn, ease, ivl, lastIvl, factor, time, type)
+SELECT m.new, cm.new, -1, r.ease, r.ivl, r.lastIvl, r.factor, r.time, r.type
+FROM {0}.revlog r
+JOIN temp._merge_rid m ON m.old = r.id
+JOIN temp._merge_cid cm ON cm.old = r.cid'''.format(alias)).rowcount
+
+    return result
+
+
+def _insert_renumbered(conn, insert_sql, *max_sql):
+    """Run an INSERT into a mapping table (new INTEGER PRIMARY KEY, old, ...) without a value for new,
+    so that new is numbered from after the greatest id of both collections.
+    """
+    table = insert_sql.split()[2]
+
+    last_id = max([conn.execute(sql).fetchone()[0] or 0 for sql in max_sql] +
+                  [conn.execute('SELECT max(new) FROM {}'.format(table)).fetchone()[0] or 0])
+
+    conn.execute('INSERT OR IGNORE INTO {} (new) VALUES (?)'.format(table), (last_id, ))
+    try:
+        conn.execute(insert_sql)
+    finally:
+        conn.execute('DELETE FROM {} WHERE new = ? AND old IS NULL'.format(table), (last_id, ))
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+
+class AnkiNote:
+    __slots__ = ('id', 'guid', 'mid', 'model', 'mod', 'usn', 'tags', 'fields', 'sfld')
+
+    def __init__(self, row, model, field_names):
+        """
+
+        :param sqlite3.Row row: row of the notes table
+        :param str model: model name
+        :param list field_names:
+        """
+        self.id = row['id']
+        self.guid = row['guid']
+        self.mid = row['mid']
+        self.model = model
+        self.mod = row['mod']
+        self.usn = row['usn']
+        self.tags = row['tags'].split()
+        self.fields = OrderedDict(zip(field_names, row['flds'].split('\x1f')))
+        self.sfld = row['sfld']
+
+    def __repr__(self):
+        return '<AnkiNote {} {!r}>'.format(self.id, self.sfld)
+
+
+class AnkiCard:
+    __slots__ = ('id', 'nid', 'did', 'ord', 'mod', 'usn', 'type', 'queue', 'due', 'ivl', 'factor', 'reps',
+                 'lapses', 'left', 'odue', 'odid')
+
+    def __init__(self, row):
+        """
+
+        :param sqlite3.Row row: row of the cards table
+        """
+        for k in self.__slots__:
+            setattr(self, k, row[k])
+
+    def __repr__(self):
+        return '<AnkiCard {} of note {}>'.format(self.id, self.nid)
+
+
+class InsertStatement:
+    __slots__ = ('sql', 'defaults')
+
+    def __init__(self, table, columns, defaults):
+        """INSERT statement of the rows of a table which only give some columns, the others taking
+        their default value. A row is built as a tuple of the given columns + statement.defaults.
+
+        :param str table:
+        :param tuple columns: columns given by each row, in order
+        :param OrderedDict defaults: default value of every column of the table
+        """
+        others = tuple(k for k in defaults.keys() if k not in columns)
+        keys = tuple(columns) + others
+
+        self.sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ','.join(keys), ','.join('?' for _ in keys))
+        self.defaults = tuple(defaults[k] for k in others)
@@ -0,0 +1,210 @@
+import re
+from collections import deque
+
+from .tools.chunks import fetch_chunks
+from .tools.text import strip_html
+
+_TAG_RE = re.compile(r'{{(.*?)}}', flags=re.DOTALL)
+_CLOZE_RE = re.compile(r'{{c(\d+)::(.*?)(?:::(.*?))?}}', flags=re.DOTALL)
+
+
+def compile_template(template, question=True):
+    """Compile a card template into a function returning its HTML, given
+    (fields, card_ord, front_side): a dict of field values, the ord of the card, and the rendered question.
+
+    Supported are {{Field}}, {{FrontSide}}, sections {{#Field}}...{{/Field}} shown if the field is not empty,
+    inverted sections {{^Field}}...{{/Field}}, and the filters text:, cloze: and type:.
+    Other filters, such as hint: or furigana:, show the field as it is.
+
+    :param str template: qfmt or afmt
+    :param bool question: whether the template is the question side, for cloze:
+    :return function:
+    """
+    return _compile(_parse(template, 0, None)[0], question)
+
+
+def _parse(template, pos, section):
+    nodes = []
+    while True:
+        match = _TAG_RE.search(template, pos)
+        if match is None:
+            if section is not None:
+                raise ValueError('Unclosed section: {}'.format(section))
+            nodes.append(template[pos:])
+            return nodes, len(template)
+
+        nodes.append(template[pos:match.start()])
+        tag = match.group(1).strip()
+        pos = match.end()
+
+        if tag[:1] in ('#', '^'):
+            children, pos = _parse(template, pos, tag[1:].strip())
+            nodes.append((tag[0], tag[1:].strip(), children))
+        elif tag[:1] == '/':
+            if tag[1:].strip() != section:
+                raise ValueError('Unexpected {{{{{}}}}}'.format(tag))
+            return nodes, pos
+        else:
+            filters = [f.strip() for f in tag.split(':')]
+            nodes.append(('=', filters.pop(), filters))
+
+
+def _compile(nodes, question):
+    parts = []
+    for node in nodes:
+        if isinstance(node, str):
+            if node:
+                parts.append(_text_part(node))
+        elif node[0] == '=':
+            parts.append(_field_part(node[1], node[2], question))
+        else:
+            parts.append(_section_part(node[1], node[0] == '^', _compile(node[2], question)))
+
+    if len(parts) == 1:
+        return parts[0]
+
+    def render(fields, card_ord, front_side):
+        return ''.join([part(fields, card_ord, front_side) for part in parts])
+
+    return render
+
+
+def _text_part(text):
+    def render(fields, card_ord, front_side):
+        return text
+
+    return render
+
+
+def _field_part(name, filters, question):
+    if name == 'FrontSide':
+        def render(fields, card_ord, front_side):
+            return front_side
+    elif not filters:
+        def render(fields, card_ord, front_side):
+            return fields.get(name, '')
+    else:
+        def render(fields, card_ord, front_side):
+            value = fields.get(name, '')
+            for f in reversed(filters):
+                if f == 'text':
+                    value = strip_html(value)
+                elif f == 'cloze':
+                    value = _cloze(value, card_ord + 1, question)
+                elif f == 'type':
+                    value = ''
+            return value
+
+    return render
+
+
+def _section_part(name, inverted, render_children):
+    def render(fields, card_ord, front_side):
+        if bool(fields.get(name, '').strip()) == inverted:
+            return ''
+        return render_children(fields, card_ord, front_side)
+
+    return render
+
+
+def _cloze(text, number, question):
+    def replace(match):
+        if int(match.group(1)) != number:
+            return match.group(2)
+        if question:
+            return '<span class=cloze>[{}]</span>'.format(match.group(3) or '...')
+        return '<span class=cloze>{}</span>'.format(match.group(2))
+
+    return _CLOZE_RE.sub(replace, text)
+
+
+class AnkiRenderer:
+    def __init__(self, models):
+        """Renders cards with the templates of models, compiled once per template and model modification.
+
+        :param dict models: model id (str) -> model, as in the models of col
+        """
+        self.models = models
+        self._templates = dict()
+        self._field_names = dict()
+
+    def render(self, mid, card_ord, flds):
+        """
+
+        :param int mid: model id of the note
+        :param int card_ord: ord of the card
+        :param str flds: fields of the note, separated by 0x1f
+        :return tuple: question and answer HTML
+        """
+        model = self.models[str(mid)]
+        key = (mid, card_ord, model.get('mod'))
+        template = self._templates.get(key)
+        if template is None:
+            # Cloze models have a single template for every card.
+            tmpl = model['tmpls'][0 if model.get('type') == 1 else card_ord]
+            template = self._templates[key] = (compile_template(tmpl['qfmt'], question=True),
+                                               compile_template(tmpl['afmt'], question=False))
+            self._field_names[mid] = [fld['name'] for fld in model['flds']]
+
+        fields = dict(zip(self._field_names[mid], flds.split('\x1f')))
+        question = template[0](fields, card_ord, '')
+        return question, template[1](fields, card_ord, question)
+
+    def render_rows(self, rows):
+        """
+
+        :param list rows: (card id, ord, mid, flds) tuples
+        :return list: (card id, question, answer) tuples
+        """
+        return [(card_id, ) + self.render(mid, card_ord, flds) for card_id, card_ord, mid, flds in rows]
+
+
+def render_cards(anki, processes=None, chunk_size=1000, **kwargs):
+    """Stream the rendered cards of a collection, fetched chunk_size at a time, in the order of their ids.
+
+    :param AnkiDatabase anki:
+    :param int processes: render chunks in this many worker processes, keeping the order of the cards
+    :param int chunk_size:
+    :param kwargs: filters of AnkiDatabase.iter_cards
+    :return generator: of (card id, question HTML, answer HTML)
+    """
+    where, params = anki._card_filter(**kwargs)
+    cursor = anki.conn.execute('SELECT c.id, c.ord, n.mid, n.flds FROM (SELECT id, nid, ord FROM cards{}) c '
+                               'JOIN notes n ON n.id = c.nid ORDER BY c.id'.format(where), params)
+    chunks = ([tuple(row) for row in rows] for rows in fetch_chunks(cursor, chunk_size))
+
+    if not processes or processes <= 1:
+        renderer = AnkiRenderer(anki._models)
+        for rows in chunks:
+            for card in renderer.render_rows(rows):
+                yield card
+        return
+
+    # Imported here, as multiprocessing is slow to import and only needed with processes.
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(anki._models, )) as executor:
+        # A few chunks per process are in flight, so that fetching does not run ahead of rendering.
+        pending = deque()
+        for rows in chunks:
+            pending.append(executor.submit(_render_rows, rows))
+            if len(pending) >= processes * 2:
+                for card in pending.popleft().result():
+                    yield card
+
+        while pending:
+            for card in pending.popleft().result():
+                yield card
+
+
+_worker_renderer = None
+
+
+def _init_worker(models):
+    global _worker_renderer
+    _worker_renderer = AnkiRenderer(models)
+
+
+def _render_rows(rows):
+    return _worker_renderer.render_rows(rows)
@@ -0,0 +1,100 @@
+import sqlite3
+
+from .tools.chunks import fetch_chunks
+
+# Each field of a note is a row of the index, whose rowid is note id * _FIELD_SLOTS + field ord,
+# so that the rows of a note are deleted through a rowid range.
+_FIELD_SLOTS = 1024
+
+# Updating or deleting more notes than this drops the index instead, as FTS5 deletes are slow and
+# building the index again on the next search is faster.
+REBUILD_THRESHOLD = 1000
+
+
+def is_built(conn):
+    return conn.execute('SELECT COUNT(*) FROM temp.sqlite_master WHERE name = "notes_fts"').fetchone()[0] > 0
+
+
+def build(anki, chunk_size=1000):
+    """Create the FTS5 table of the fields of every note. It is a temp table, which is never part of
+    the saved package, and is kept in a temporary file unless temp_store is MEMORY.
+
+    :param AnkiDatabase anki:
+    :param int chunk_size:
+    """
+    try:
+        anki.conn.execute("CREATE VIRTUAL TABLE temp.notes_fts USING fts5(field UNINDEXED, content, "
+                          "tokenize='unicode61 remove_diacritics 2')")
+    except sqlite3.OperationalError as e:
+        if 'fts5' in str(e):
+            raise ValueError('SQLite of this Python is not compiled with FTS5.') from e
+        raise
+
+    cursor = anki.conn.execute('SELECT id, mid, flds FROM notes')
+    for rows in fetch_chunks(cursor, chunk_size):
+        index_notes(anki, [tuple(row) for row in rows])
+
+
+def index_notes(anki, notes):
+    """
+
+    :param AnkiDatabase anki:
+    :param list notes: (id, mid, flds) of new notes
+    """
+    sfld_extractor = anki.sfld_extractor
+    field_names = dict()
+    rows = []
+    for nid, mid, flds in notes:
+        names = field_names.get(mid)
+        if names is None:
+            model = anki._models.get(str(mid))
+            names = field_names[mid] = [fld['name'] for fld in model['flds']] if model is not None else []
+
+        for i, (name, value) in enumerate(zip(names[:_FIELD_SLOTS], flds.split('\x1f'))):
+            if value:
+                rows.append((int(nid) * _FIELD_SLOTS + i, name, sfld_extractor(value)))
+
+    anki.conn.executemany('INSERT INTO temp.notes_fts (rowid, field, content) VALUES (?, ?, ?)', rows)
+
+
+def unindex_notes(anki, note_ids):
+    """
+
+    :param AnkiDatabase anki:
+    :param iterable note_ids:
+    """
+    anki.conn.executemany('DELETE FROM temp.notes_fts WHERE rowid >= ? AND rowid < ?',
+                          ((int(nid) * _FIELD_SLOTS, (int(nid) + 1) * _FIELD_SLOTS) for nid in note_ids))
+
+
+def drop(anki):
+    anki.conn.execute('DROP TABLE IF EXISTS temp.notes_fts')
+
+
+def search(anki, query, fields=None, limit=None, **kwargs):
+    """Notes matching an FTS5 query on their fields, best match first.
+
+    :param AnkiDatabase anki:
+    :param str query: FTS5 query, e.g. 'casa' or '"la casa" OR casita'
+    :param list fields: only match these fields
+    :param int limit:
+    :param kwargs: filters of AnkiDatabase.iter_notes
+    :return sqlite3.Cursor: of the rows of the notes
+    """
+    conditions = ['notes_fts MATCH ?']
+    params = [query]
+    if fields is not None:
+        fields = [fields] if isinstance(fields, str) else list(fields)
+        conditions.append('field IN ({})'.format(','.join('?' for _ in fields)))
+        params.extend(fields)
+
+    where, note_params = anki._note_filter(**kwargs)
+    sql = 'SELECT notes.* FROM (SELECT rowid / {} AS nid, min(rank) AS rank FROM temp.notes_fts ' \
+          'WHERE {} GROUP BY nid) m JOIN main.notes ON notes.id = m.nid{} ORDER BY m.rank' \
+        .format(_FIELD_SLOTS, ' AND '.join(conditions), where)
+    params.extend(note_params)
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    return anki.conn.execute(sql, params)
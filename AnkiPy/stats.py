@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from time import perf_counter
+
+
+class AnkiStats:
+    def __init__(self, on_operation=None):
+        """Counters and cumulative timers of operations and phases (sql, json, html, ids, zip...).
+
+        :param callable on_operation: called with (name, seconds, rows) after each timed operation
+        """
+        self.on_operation = on_operation
+        self._stats = OrderedDict()
+
+    def timer(self, name, rows=0):
+        """Context manager timing one operation. Its rows attribute can be set inside the block.
+        """
+        return _Timer(self, name, rows)
+
+    def record(self, name, seconds, rows=0):
+        stat = self._stats.get(name)
+        if stat is None:
+            stat = self._stats[name] = OrderedDict([('count', 0), ('seconds', 0.0), ('rows', 0)])
+
+        stat['count'] += 1
+        stat['seconds'] += seconds
+        stat['rows'] += rows
+
+        if self.on_operation is not None:
+            self.on_operation(name, seconds, rows)
+
+    def as_dict(self):
+        return OrderedDict((name, OrderedDict(stat)) for name, stat in self._stats.items())
+
+    def reset(self):
+        self._stats.clear()
+
+
+class _Timer:
+    __slots__ = ('stats', 'name', 'rows', 'start')
+
+    def __init__(self, stats, name, rows):
+        self.stats = stats
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stats.record(self.name, perf_counter() - self.start, self.rows)
+
+
+class _NullTimer:
+    """Timer of disabled instrumentation, which does nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def __setattr__(self, key, value):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class TracedConnection:
+    def __init__(self, conn, stats, trace=False):
+        """Wraps a sqlite3.Connection to time every call running SQL, as the 'sql' phase of stats.
+        Time spent fetching rows after execute() returns is not included.
+
+        :param sqlite3.Connection conn:
+        :param AnkiStats stats:
+        :param bool trace: also log the statements actually run, including those of executescript,
+            with the timing of their call to the 'AnkiPy.sql' logger at DEBUG level, using the trace callback
+        """
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_stats', stats)
+        object.__setattr__(self, '_statements', [])
+        if trace:
+            # Imported here, as logging is slow to import and only needed to trace.
+            import logging
+
+            object.__setattr__(self, '_logger', logging.getLogger('AnkiPy.sql'))
+            conn.set_trace_callback(self._statements.append)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def _run(self, method, *args):
+        start = perf_counter()
+        cursor = None
+        try:
+            cursor = method(*args)
+            return cursor
+        finally:
+            seconds = perf_counter() - start
+            rows = getattr(cursor, 'rowcount', -1)
+            self._stats.record('sql', seconds, rows if rows > 0 else 0)
+
+            if self._statements:
+                statements = self._statements[:]
+                del self._statements[:]
+
+                if len(statements) == 1:
+                    self._logger.debug('%.3f ms %s', seconds * 1000, statements[0])
+                else:
+                    self._logger.debug('%.3f ms for %d statements', seconds * 1000, len(statements))
+                    for statement in statements:
+                        self._logger.debug('    %s', statement)
+
+    def execute(self, *args):
+        return self._run(self._conn.execute, *args)
+
+    def executemany(self, *args):
+        return self._run(self._conn.executemany, *args)
+
+    def executescript(self, *args):
+        return self._run(self._conn.executescript, *args)
+
+    def commit(self):
+        return self._run(self._conn.commit)
@@ -0,0 +1,22 @@
+from itertools import islice
+
+
+def chunks(iterable, size):
+    """Lists of up to size items of iterable, without reading it further ahead.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch_chunks(cursor, size):
+    """Rows of a cursor, fetched size at a time.
+    """
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
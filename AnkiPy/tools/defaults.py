@@ -1,6 +1,31 @@
-import importlib_resources
 import json
 from collections import OrderedDict
+from collections.abc import Mapping
 
 
-DEFAULTS = json.loads(importlib_resources.read_text('AnkiPy', 'defaults.json'), object_pairs_hook=OrderedDict)
+class _Defaults(Mapping):
+    """Contents of defaults.json, which is only read and parsed when first needed.
+    """
+    def __init__(self):
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            import importlib_resources
+
+            self._data = json.loads(importlib_resources.read_text('AnkiPy', 'defaults.json'),
+                                    object_pairs_hook=OrderedDict)
+
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+
+DEFAULTS = _Defaults()
@@ -0,0 +1,135 @@
+import re
+from html import unescape
+from html.entities import html5
+from html.parser import HTMLParser
+from functools import lru_cache
+
+_ASCII_SPACES = ' \n\t\x0c\r'
+
+
+def strip_html(text):
+    """Text content of an HTML field, as used for the sort field of a note.
+
+    Fields without markup, other than whitespace only, are returned unchanged, without being parsed.
+
+    :param str text:
+    :return str:
+    """
+    if '<' not in text and '&' not in text and (text.strip(_ASCII_SPACES) or not text):
+        return text
+
+    return _strip_html(text)
+
+
+@lru_cache(maxsize=4096)
+def _strip_html(text):
+    parser = _TextParser()
+    parser.feed(text)
+    parser.close()
+    parser.flush()
+
+    return ''.join(parser.parts)
+
+
+_IMG_RE = re.compile(r'<img[^>]+src=["\']?([^"\'>]+)["\']?[^>]*>', flags=re.IGNORECASE)
+
+
+def keep_media_names(text):
+    """Replace the <img> tags of a field with the names of their files, as Anki's stripHTMLMedia does
+    before stripping the HTML, so that fields showing different images have different text.
+
+    :param str text:
+    :return str:
+    """
+    if '<' not in text:
+        return text
+
+    return _IMG_RE.sub(r' \1 ', text)
+
+
+def bs4_text(text):
+    """Text content of an HTML field, extracted by BeautifulSoup.
+
+    :param str text:
+    :return str:
+    """
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(text, 'html.parser').text
+
+
+class _TextParser(HTMLParser):
+    """Collects text the same way as BeautifulSoup(text, 'html.parser').text does.
+
+    As in BeautifulSoup, the text between two tags is a string, which is replaced with a single newline
+    or space if it is only whitespace, unless it is inside <pre> or <textarea>.
+    """
+    skipped_tags = {'script', 'style', 'template', 'rt', 'rp'}
+    preserving_tags = {'pre', 'textarea'}
+    void_tags = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta',
+                 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex',
+                 'nextid', 'spacer'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.parts = []
+        self._data = []
+        # Open tags. As in BeautifulSoup, an end tag closes every tag opened after the last one of its name,
+        # and is ignored if there is none.
+        self._stack = []
+        # Void tags opened without />, whose next end tag BeautifulSoup ignores, without ending the string
+        self._closed_void = []
+
+    def flush(self):
+        if not self._data:
+            return
+
+        data = ''.join(self._data)
+        self._data = []
+        if not data.strip(_ASCII_SPACES) and not any(tag in self.preserving_tags for tag in self._stack):
+            data = '\n' if '\n' in data else ' '
+        self.parts.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag not in self.void_tags:
+            self._stack.append(tag)
+        else:
+            self._closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush()
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void:
+            self._closed_void.remove(tag)
+            return
+
+        self.flush()
+        if tag in self._stack:
+            del self._stack[len(self._stack) - 1 - self._stack[::-1].index(tag):]
+
+    def handle_data(self, data):
+        if not any(tag in self.skipped_tags for tag in self._stack):
+            self._data.append(data)
+
+    def handle_charref(self, name):
+        self.handle_data(unescape('&#{};'.format(name)))
+
+    def handle_entityref(self, name):
+        self.handle_data(html5.get(name + ';', '&' + name))
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+
+    def handle_pi(self, data):
+        self.flush()
+
+    def unknown_decl(self, data):
+        self.flush()
+        if data.upper().startswith('CDATA['):
+            self.handle_data(data[len('CDATA['):])
+            self.flush()
@@ -0,0 +1,179 @@
+"""Benchmarks of the write, read and packaging paths of AnkiPy, on synthetic collections.
+
+    python -m dev.benchmark --sizes 1000 100000 1000000 --output bench.json
+
+Results are written as JSON, one entry per size, model and phase, so that runs can be compared.
+Each size and model runs in a process of its own, so that its peak memory is not the one of an earlier run.
+"""
+import argparse
+import json
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import mkdtemp
+from time import perf_counter
+
+from AnkiPy import Anki
+
+MODELS = OrderedDict([
+    ('basic', None),
+    ('multi_field', dict(
+        name='multi_field',
+        fields=["English", "Spanish", "French", "Example", "Notes"],
+        templates=["{0} \n<hr id=answer>\n {1}<br>{2}", "{1} \n<hr id=answer>\n {0}<br>{3}"],
+        css='.card { font-family: Tahoma; }'
+    ))
+])
+
+
+class Benchmark:
+    def __init__(self, trace_memory=False):
+        """
+
+        :param bool trace_memory: record the peak of Python allocations of each phase with tracemalloc,
+            which slows down every phase
+        """
+        self.trace_memory = trace_memory
+        self.results = []
+
+    @contextmanager
+    def phase(self, size, model, name, operations=1):
+        """Time the block as one phase. operations is the number of notes, lookups... done by the block.
+        """
+        if self.trace_memory:
+            tracemalloc.start()
+
+        rss = _max_rss_kb()
+        start = perf_counter()
+        yield
+        seconds = perf_counter() - start
+        max_rss = _max_rss_kb()
+
+        result = OrderedDict([
+            ('size', size),
+            ('model', model),
+            ('phase', name),
+            ('seconds', seconds),
+            ('operations', operations),
+            ('us_per_operation', seconds / operations * 1e6 if operations else None),
+            # The peak resident memory of the process so far, and by how much the phase raised it
+            ('process_max_rss_kb', max_rss),
+            ('max_rss_growth_kb', max_rss - rss)
+        ])
+        if self.trace_memory:
+            result['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+        self.results.append(result)
+        print('{size:>9} {model:<12} {phase:<16} {seconds:10.3f} s {us_per_operation:12.1f} us/op'
+              .format(**result), file=sys.stderr)
+
+    def run(self, size, model, temp_dir):
+        model_kwargs = MODELS[model]
+        model_name = 'Basic' if model_kwargs is None else model_kwargs['name']
+        n_fields = 2 if model_kwargs is None else len(model_kwargs['fields'])
+        path = str(Path(temp_dir).joinpath('{}-{}.apkg'.format(model, size)))
+
+        with Anki(path) as anki:
+            if model_kwargs is not None:
+                anki.new_model(**model_kwargs)
+            deck = anki.deck('bench')
+
+            with self.phase(size, model, 'bulk_insert', size):
+                deck.add_items(_notes(size, n_fields), model=model_name)
+
+            per_note = min(size, 1000)
+            with self.phase(size, model, 'per_note_insert', per_note):
+                for fields in _notes(per_note, n_fields, prefix='extra'):
+                    deck.add_item(*fields, model=model_name)
+
+            with self.phase(size, model, 'save', 1):
+                anki.save()
+
+        with self.phase(size, model, 'open', 1):
+            anki = Anki(path)
+
+        try:
+            with self.phase(size, model, 'deck_lookup', 10000):
+                for _ in range(10000):
+                    anki.deck('bench')
+
+            with self.phase(size, model, 'model_lookup', 10000):
+                for _ in range(10000):
+                    anki._model(model_name)
+
+            with self.phase(size, model, 'iter_notes', size + per_note):
+                for _ in anki.iter_notes():
+                    pass
+
+            anki.deck('bench').add_item(*next(_notes(1, n_fields, prefix='resave')), model=model_name)
+            with self.phase(size, model, 'resave', 1):
+                anki.save()
+        finally:
+            anki.close()
+
+
+def _notes(count, n_fields, prefix='word'):
+    for i in range(count):
+        yield tuple(['{} {}'.format(prefix, i)] +
+                    ['<b>{}</b> {} {}'.format(prefix, j, i) for j in range(1, n_fields)])
+
+
+def _max_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--models', nargs='+', default=list(MODELS.keys()), choices=list(MODELS.keys()))
+    parser.add_argument('--trace-memory', action='store_true', help='record peak Python allocations per phase')
+    parser.add_argument('--output', help='JSON file of the results, instead of stdout')
+    parser.add_argument('--worker', nargs=3, metavar=('SIZE', 'MODEL', 'TEMP_DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        size, model, temp_dir = args.worker
+        benchmark = Benchmark(trace_memory=args.trace_memory)
+        benchmark.run(int(size), model, temp_dir)
+        json.dump(benchmark.results, sys.stdout)
+        return
+
+    results = []
+    temp_dir = mkdtemp()
+    try:
+        for size in args.sizes:
+            for model in args.models:
+                command = [sys.executable, '-m', 'dev.benchmark', '--worker', str(size), model, temp_dir]
+                if args.trace_memory:
+                    command.append('--trace-memory')
+                output = subprocess.check_output(command, cwd=str(Path(__file__).resolve().parents[1]),
+                                                 universal_newlines=True)
+                results.extend(json.loads(output, object_pairs_hook=OrderedDict))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    report = OrderedDict([
+        ('python', platform.python_version()),
+        ('sqlite', sqlite3.sqlite_version),
+        ('platform', platform.platform()),
+        ('results', results)
+    ])
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
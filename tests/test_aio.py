@@ -0,0 +1,73 @@
+import asyncio
+import gc
+import threading
+from pathlib import Path
+
+import pytest
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki
+from AnkiPy.aio import AsyncAnki
+
+
+def test_async_anki():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('async.apkg')))
+
+    async def export():
+        async with AsyncAnki(out_file) as anki:
+            await anki.new_model(name='test_model', fields=["English", "Spanish", "French"])
+            deck = await anki.deck('test')
+
+            results = await asyncio.gather(
+                *[deck.add_items([("Word {} {}".format(i, j), "Mot") for j in range(10)]) for i in range(5)],
+                anki.add_items([("Hello", "Hola")], model='not_existed'),
+                deck.add_item("Hello", "Hola", "Bonjour", model='test_model'),
+                return_exceptions=True
+            )
+            assert results[:5] == [10] * 5
+            assert isinstance(results[5], ValueError)
+            assert results[6] == 1
+
+            assert await anki.save()
+
+        with pytest.raises(ValueError):
+            await anki.save()
+
+    asyncio.run(export())
+
+    with Anki(out_file) as anki:
+        assert anki.count_notes(deck='test') == 51
+        assert anki.count_notes(model='test_model') == 1
+
+
+def test_async_anki_release():
+    semaphore = threading.Semaphore(1)
+
+    async def export():
+        async with AsyncAnki(nonrepeat_filename(str(Path('tests/output').joinpath('async_outer.apkg'))),
+                             semaphore=semaphore) as outer:
+            async with AsyncAnki(nonrepeat_filename(str(Path('tests/output').joinpath('async_inner.apkg'))),
+                                 semaphore=semaphore) as inner:
+                assert await inner.add_item("Hello", "Hola", deck='test') == 1
+                assert await outer.add_item("Hello", "Bonjour", deck='test') == 1
+
+        cancelled = AsyncAnki(nonrepeat_filename(str(Path('tests/output').joinpath('async_cancelled.apkg'))),
+                              semaphore=semaphore)
+        with semaphore:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(cancelled.open(), timeout=0.1)
+        with pytest.raises(ValueError):
+            await cancelled.save()
+
+        forgotten = AsyncAnki(nonrepeat_filename(str(Path('tests/output').joinpath('async_forgotten.apkg'))),
+                              semaphore=semaphore)
+        await forgotten.open()
+        workers = [cancelled._worker, forgotten._worker]
+        del forgotten
+        gc.collect()
+
+        return workers
+
+    for worker in asyncio.run(asyncio.wait_for(export(), timeout=30)):
+        worker.thread.join(timeout=10)
+        assert not worker.thread.is_alive()
@@ -0,0 +1,65 @@
+from pathlib import Path
+from time import time
+
+import pytest
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki
+
+np = pytest.importorskip('numpy')
+
+from AnkiPy import analytics  # noqa: E402
+
+
+def test_analytics():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('analytics.apkg')))
+
+    with Anki(out_file) as anki:
+        anki.deck('test').add_items([("House", "casa"), ("Dog", "perro"), ("Cat", "gato")])
+        anki.deck('other').add_items([("Tree", "árbol")])
+        cards = [tuple(row) for row in anki.conn.execute('SELECT cards.id, did, sfld FROM cards '
+                                                         'JOIN notes ON notes.id = cards.nid ORDER BY cards.id')]
+
+        day = 86400 * 1000
+        start = (int(time() * 1000) // day - 10) * day
+        revlog = [
+            # id, cid, usn, ease, ivl, lastIvl, factor, time, type
+            (start + 1, cards[0][0], -1, 3, 1, 0, 2500, 4000, 0),
+            (start + day + 1, cards[0][0], -1, 1, 1, 1, 2500, 6000, 1),
+            (start + day + 2, cards[1][0], -1, 3, 4, 2, 2500, 2000, 1),
+            (start + 5 * day, cards[2][0], -1, 4, 40, 20, 2500, 1000, 1),
+            (start + 5 * day + 1, cards[3][0], -1, 1, 1, 100, 2500, 3000, 1),
+        ]
+        anki.conn.executemany('INSERT INTO revlog VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', revlog)
+
+        crt = anki.conn.execute('SELECT crt FROM col').fetchone()[0]
+        today = int((time() - crt) // 86400)
+        anki.conn.executemany('UPDATE cards SET queue = 2, type = 2, due = ?, lapses = ?, reps = ? WHERE id = ?', [
+            (today - 3, 3, 6, cards[0][0]),
+            (today + 2, 0, 2, cards[1][0]),
+            (today + 40, 1, 4, cards[2][0]),
+            (today + 29, 2, 2, cards[3][0])
+        ])
+
+        reviews = analytics.daily_reviews(anki, chunk_size=2)
+        assert reviews['day'][0] == np.datetime64(start // day, 'D')
+        assert reviews['reviews'].tolist() == [1, 2, 0, 0, 0, 2]
+        assert reviews['seconds'].tolist() == [4, 8, 0, 0, 0, 4]
+        assert analytics.daily_reviews(anki, deck='other')['reviews'].tolist() == [1]
+        assert len(analytics.daily_reviews(anki, since=time())['day']) == 0
+
+        assert analytics.ease_distribution(anki)[1].tolist() == [2, 0, 1, 1]
+
+        result = analytics.retention(anki, buckets=(1, 7, 30), chunk_size=3)
+        assert result['reviews'].tolist() == [2, 1, 1]
+        assert result['retention'].tolist() == [0.5, 1.0, 0.0]
+
+        forecast = analytics.due_forecast(anki, days=30, chunk_size=3)
+        assert list(forecast.keys()) == ['test', 'other']
+        assert forecast['test'][0] == 1 and forecast['test'][2] == 1 and forecast['test'].sum() == 2
+        assert forecast['other'][29] == 1 and forecast['other'].sum() == 1
+
+        hotspots = analytics.lapse_hotspots(anki, limit=2)
+        assert [(h['sfld'], h['lapses'], h['reps']) for h in hotspots] == [("House", 3, 6), ("Tree", 2, 2)]
+        assert hotspots[1]['lapse_rate'] == 1.0
+        assert [h['sfld'] for h in analytics.lapse_hotspots(anki, min_lapses=2, deck='test')] == ["House"]
@@ -1,6 +1,10 @@
 import pytest
+from hashlib import sha1
 from pathlib import Path
+import os
 import shutil
+import subprocess
+import sys
 from nonrepeat import nonrepeat_filename
 
 from AnkiPy import Anki
@@ -86,3 +90,261 @@ def test_basic_context(in_file, has_template, has_css):
         test_deck.add_item("How are you ?", "Como estas?", "Comment ca va ?", model='test_model')
         test_deck.add_item("Flower", "flor", "fleur", model='test_model')
         test_deck.add_item("House", "Casa", "Maison", model='test_model')
+
+
+def test_add_items():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('add_items.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_deck = test_anki.deck('test')
+
+        count = test_deck.add_items(("Word {}".format(i), "Mot {}".format(i)) for i in range(2500))
+        assert count == 2500
+
+        count = test_deck.add_items([
+            {'fields': ("Hello", "Bonjour"), 'tags': ['greeting']},
+            ("Flower", "fleur")
+        ], tags='noun')
+        assert count == 2
+
+        assert test_anki.conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 2502
+        assert test_anki.conn.execute('SELECT COUNT(DISTINCT id) FROM cards').fetchone()[0] == 2502
+        assert test_anki.conn.execute('SELECT tags FROM notes WHERE sfld = "Hello"').fetchone()[0] == ' greeting '
+        assert test_anki.conn.execute('SELECT tags FROM notes WHERE sfld = "Flower"').fetchone()[0] == ' noun '
+
+
+def test_col_cache():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('col_cache.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_anki.new_model(name='test_model', fields=["English", "French"])
+        assert test_anki.deck('test') is test_anki.deck('test')
+
+        with pytest.raises(ValueError):
+            test_anki.new_model(name='test_model', fields=["English", "French"])
+
+    with Anki(out_file) as test_anki:
+        assert test_anki.get_deck('test').name == 'test'
+        assert test_anki._model('test_model')['flds'][1]['name'] == 'French'
+
+
+def test_transaction():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('transaction.apkg')))
+
+    with Anki(out_file, autocommit=False) as test_anki:
+        with test_anki.transaction():
+            test_deck = test_anki.deck('test')
+            with test_anki.transaction():
+                test_deck.add_item("Hello", "Bonjour")
+
+        with pytest.raises(KeyError):
+            with test_anki.transaction():
+                test_anki.deck('rolled back').add_item("Flower", "fleur")
+                raise KeyError
+
+        assert test_anki.conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 1
+        with pytest.raises(ValueError):
+            test_anki.get_deck('rolled back')
+
+
+def test_bulk_load():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('bulk_load.apkg')))
+
+    with Anki(out_file) as test_anki:
+        schema = test_anki.conn.execute('SELECT type, name, sql FROM sqlite_master WHERE type != "table"').fetchall()
+
+        with test_anki.bulk_load() as timing:
+            test_anki.deck('test').add_items(("Word {}".format(i), "Mot {}".format(i)) for i in range(1000))
+
+        assert set(timing.keys()) == {'load', 'rebuild'}
+        assert test_anki.conn.execute('SELECT type, name, sql FROM sqlite_master '
+                                      'WHERE type != "table"').fetchall() == schema
+        assert test_anki.conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+        assert test_anki.conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 1000
+
+        with pytest.raises(KeyError):
+            with test_anki.bulk_load():
+                test_anki.deck('test').add_items([("Failed", "Échoué")] * 5)
+                raise KeyError
+
+        assert test_anki.conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 1000
+        assert test_anki.conn.execute('SELECT type, name, sql FROM sqlite_master '
+                                      'WHERE type != "table"').fetchall() == schema
+
+        with pytest.raises(KeyError):
+            with test_anki.transaction():
+                test_anki.deck('test').add_item("Outer", "Extérieur")
+                with pytest.raises(ValueError):
+                    with test_anki.bulk_load():
+                        pass
+                raise KeyError
+
+        assert test_anki.conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 1000
+
+
+def test_duplicates():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('duplicates.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_deck = test_anki.deck('test')
+        assert test_deck.add_items([("Hello", "Bonjour"), ("<b>Flower</b>", "fleur")]) == 2
+
+        assert test_deck.add_items([("Hello", "Salut"), ("House", "Maison"), ("House", "Maison")],
+                                   on_duplicate='skip') == 1
+        assert test_deck.add_items([("Hello", "Salut"), ("Flower", "fleur")], on_duplicate='update') == 2
+        assert test_deck.add_items([("Hello", "Salut")], on_duplicate='update') == 0
+
+        with pytest.raises(ValueError):
+            test_deck.add_item("House", "Maison", on_duplicate='error')
+
+        rows = test_anki.conn.execute('SELECT sfld, flds, csum FROM notes ORDER BY id').fetchall()
+        assert [tuple(row)[:2] for row in rows] == [
+            ("Hello", "Hello\x1fSalut"),
+            ("Flower", "Flower\x1ffleur"),
+            ("House", "House\x1fMaison")
+        ]
+        assert rows[0]['csum'] == int('f7ff9e8b', 16)
+
+        images = [('<img src="cat.jpg">', "chat"), ('<img src="dog.jpg">', "chien")]
+        assert test_deck.add_items(images, on_duplicate='skip') == 2
+        assert test_deck.add_items(images[1:], on_duplicate='skip') == 0
+        with pytest.raises(ValueError):
+            test_deck.add_item('<img src="dog.jpg">', "chien", on_duplicate='error')
+        assert test_deck.add_items([('<img src="cat.jpg">', "minou")], on_duplicate='update') == 1
+        assert test_anki.conn.execute('SELECT flds FROM notes WHERE flds LIKE "%dog%"').fetchone()[0] == \
+            '<img src="dog.jpg">\x1fchien'
+        assert test_anki.conn.execute('SELECT csum FROM notes WHERE flds LIKE "%cat%"').fetchone()[0] == \
+            int(sha1(b' cat.jpg ').hexdigest()[:8], 16)
+
+
+def test_new_ids():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('new_ids.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_anki.conn.execute('INSERT INTO cards (id, nid, did, ord, mod, usn, type, queue, due, ivl, factor, '
+                               'reps, lapses, left, odue, odid, flags, data) '
+                               'VALUES (99999999999999, 1, 1, 0, 0, -1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, "")')
+        test_anki.deck('test').add_items([("Hello", "Bonjour"), ("Flower", "fleur")])
+
+    with Anki(out_file) as test_anki:
+        first = test_anki._reserve_ids('cid', 10)
+        assert first > 99999999999999 + 2
+        assert test_anki._new_id('cid') == first + 10
+        assert test_anki._new_id('nid') > test_anki.conn.execute('SELECT max(id) FROM notes').fetchone()[0]
+
+
+def test_iter_notes():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('iter_notes.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_anki.new_model(name='test_model', fields=["English", "Spanish", "French"])
+        test_anki.deck('test').add_items(("Word {}".format(i), "Mot {}".format(i)) for i in range(25))
+        test_anki.deck('other').add_items([("Hello", "Hola", "Bonjour")], model='test_model', tags='greeting')
+
+    with Anki(out_file) as test_anki:
+        notes = list(test_anki.iter_notes(deck='test', chunk_size=10))
+        assert len(notes) == test_anki.count_notes(deck='test') == 25
+        assert notes[0].fields == {'Front': 'Word 0', 'Back': 'Mot 0'}
+
+        note, = test_anki.iter_notes(tag='greeting')
+        assert note.model == 'test_model'
+        assert note.fields['French'] == 'Bonjour'
+        assert note.tags == ['greeting']
+
+        cards = list(test_anki.iter_cards(model='test_model'))
+        assert [card.nid for card in cards] == [note.id]
+        assert test_anki.count_cards(deck='test', queue=0) == 25
+        assert test_anki.count_notes(model='test_model', usn=-1) == 1
+
+
+def test_stats(caplog):
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('stats.apkg')))
+    operations = []
+
+    with Anki(out_file) as test_anki:
+        test_anki.deck('test').add_items(("Word {}".format(i), "<b>Mot</b> {}".format(i)) for i in range(25))
+        assert test_anki.stats() == {}
+
+    with caplog.at_level('DEBUG', logger='AnkiPy.sql'):
+        with Anki(out_file, on_operation=lambda *args: operations.append(args), trace_sql=True) as test_anki:
+            assert test_anki.deck('test').add_items([("Hello", "Hola")] * 10) == 10
+            test_anki.save()
+
+            stats = test_anki.stats()
+            assert stats['add_items']['count'] == 1
+            assert stats['add_items']['rows'] == 10
+            assert stats['html']['rows'] == 10
+            for name in ('sql', 'json', 'ids', 'commit', 'save', 'zip'):
+                assert stats[name]['count'] > 0
+                assert stats[name]['seconds'] >= 0
+
+    assert ('add_items', stats['add_items']['seconds'], 10) in operations
+    assert any('INSERT INTO notes' in message for message in caplog.messages)
+
+
+def test_update_delete():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('update_delete.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_anki.deck('test').add_items(("Word {}".format(i), "teh word") for i in range(30))
+        test_anki.deck('test::sub').add_items([("Sub", "sub")], tags='sub')
+        test_anki.deck('other').add_items([("Other", "other")], tags='keep old')
+        test_anki.mark_synced(usn=1)
+
+        assert test_anki.update_notes(where={'deck': 'test'}, set_fields={'Back': lambda v: v.replace('teh', 'the')},
+                                      add_tags='fixed', chunk_size=7) == 30
+        assert test_anki.count_notes(tag='fixed', usn=-1) == 30
+        note = next(test_anki.iter_notes(deck='test'))
+        assert note.fields['Back'] == 'the word'
+
+        note = next(test_anki.iter_notes(deck='other'))
+        assert test_anki.update_notes(where=[note.id], set_fields={'Front': '<b>Another</b>'},
+                                      remove_tags='old') == 1
+        note = next(test_anki.iter_notes(deck='other'))
+        assert (note.sfld, note.tags) == ('Another', ['keep'])
+        assert test_anki.conn.execute('SELECT csum FROM notes WHERE id = ?', (note.id, )).fetchone()[0] == \
+            int(sha1(b'Another').hexdigest()[:8], 16)
+
+        with pytest.raises(ValueError):
+            test_anki.update_notes(where={}, set_fields={'Missing': ''})
+        with pytest.raises(TypeError):
+            test_anki.delete_notes()
+        with pytest.raises(ValueError):
+            test_anki.delete_notes(where=None)
+
+        assert test_anki.delete_notes(where={'tag': 'keep'}) == {'notes': 1, 'cards': 1, 'revlog': 0}
+        assert test_anki.delete_deck('test') == {'decks': 2, 'notes': 31, 'cards': 31, 'revlog': 0}
+        assert test_anki.count_notes() == 0
+        assert 'test::sub' not in test_anki._deck_ids
+
+        assert [tuple(row) for row in test_anki.conn.execute('SELECT type, COUNT(*) FROM graves WHERE usn = -1 '
+                                                             'GROUP BY type ORDER BY type')] == \
+            [(0, 32), (1, 32), (2, 2)]
+
+
+def test_lazy_imports():
+    code = 'import sys, AnkiPy; print(" ".join(sorted(sys.modules)))'
+    modules = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).split()
+    for module in ('bs4', 'importlib_resources', 'multiprocessing', 'logging', 'numpy'):
+        assert module not in modules
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='POSIX file modes')
+def test_save_mode():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('save_mode.apkg')))
+
+    umask = os.umask(0o027)
+    try:
+        with Anki(out_file) as test_anki:
+            test_anki.deck('test').add_item("Hello", "Hola")
+        assert os.umask(0o027) == 0o027
+        assert os.stat(out_file).st_mode & 0o777 == 0o640
+
+        os.chmod(out_file, 0o600)
+        with Anki(out_file) as test_anki:
+            test_anki.deck('test').add_item("Goodbye", "Adiós")
+        assert os.stat(out_file).st_mode & 0o777 == 0o600
+    finally:
+        os.umask(umask)
+
+    assert not [p for p in Path(out_file).parent.iterdir() if p.name.endswith('.tmp')]
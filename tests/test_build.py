@@ -0,0 +1,40 @@
+from pathlib import Path
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki, build_packages
+
+
+def _words():
+    for i in range(100):
+        yield "Word {}".format(i), "Mot {}".format(i)
+
+
+def test_build_packages():
+    paths = [nonrepeat_filename(str(Path('tests/output').joinpath('build_{}.apkg'.format(name))))
+             for name in ('words', 'model', 'failed')]
+    progress = []
+
+    results = build_packages([
+        {
+            'path': paths[0],
+            'decks': [{'name': 'test', 'notes': _words}]
+        },
+        {
+            'path': paths[1],
+            'models': [{'name': 'test_model', 'fields': ["English", "Spanish", "French"]}],
+            'decks': [{'name': 'test', 'model': 'test_model', 'notes': [("Hello", "Hola", "Bonjour")]}]
+        },
+        {
+            'path': paths[2],
+            'decks': [{'name': 'test', 'model': 'not_existed', 'notes': [("Hello", "Bonjour")]}]
+        }
+    ], workers=2, on_progress=progress.append)
+
+    assert [result.ok for result in results] == [True, True, False]
+    assert [result.notes for result in results[:2]] == [100, 1]
+    assert 'not_existed' in results[2].error
+    assert sorted(result.path for result in progress) == sorted(paths)
+    assert not Path(paths[2]).exists()
+
+    with Anki(paths[0]) as anki:
+        assert anki.count_notes(deck='test') == 100
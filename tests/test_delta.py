@@ -0,0 +1,35 @@
+from pathlib import Path
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki
+
+
+def test_export_delta():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('delta.apkg')))
+    delta_file = nonrepeat_filename(str(Path('tests/output').joinpath('delta_changes.apkg')))
+
+    with Anki(out_file) as anki:
+        anki.deck('test').add_items(("Word {}".format(i), "Mot {}".format(i)) for i in range(10))
+        anki.add_media(b'ID3 old', name='old.mp3')
+        assert anki.mark_synced(usn=1) == {'notes': 10, 'cards': 10, 'revlog': 0, 'graves': 0}
+
+    with Anki(out_file) as anki:
+        anki.new_model(name='test_model', fields=["English", "Spanish", "French"])
+        anki.deck('new').add_item("Hello", "Hola", "Bonjour [sound:hello.mp3]", model='test_model')
+        anki.deck('test').add_items([("Word 0", "Mot zero")], on_duplicate='update')
+        anki.add_media(b'ID3 hello', name='hello.mp3')
+
+        assert anki.export_delta(delta_file) == {'notes': 2, 'cards': 1, 'revlog': 0, 'graves': 0, 'media': 1}
+        # The card of the updated note is unchanged, so the note is also part of the older delta.
+        assert anki.export_delta(str(delta_file) + '-old', usn=1)['notes'] == 10
+        assert anki.export_delta(str(delta_file) + '-since', since=0)['notes'] == 11
+
+    with Anki(out_file) as anki:
+        assert anki.conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE name LIKE "%_mod"').fetchone()[0] == 0
+
+    with Anki(delta_file) as delta:
+        assert sorted(note.sfld for note in delta.iter_notes()) == ['Hello', 'Word 0']
+        assert delta.count_cards(deck='new') == 1
+        assert sorted(deck['name'] for deck in delta._decks.values()) == ['new']
+        assert sorted(model['name'] for model in delta._models.values()) == ['Basic', 'test_model']
+        assert delta.media.names() == ['hello.mp3']
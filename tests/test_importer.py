@@ -0,0 +1,48 @@
+import json
+import pytest
+from pathlib import Path
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki
+from AnkiPy.cli import main
+
+
+def test_import_csv(tmpdir):
+    source = Path(str(tmpdir)).joinpath('words.csv')
+    source.write_text('English,Spanish,French,tags,deck\n'
+                      'Hello,Hola,Bonjour,greeting,Phrases\n'
+                      'Flower,flor,fleur,,\n'
+                      'House,Casa,Maison,noun,\n', encoding='utf8')
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('import_csv.apkg')))
+    progress = []
+
+    with Anki(out_file) as test_anki:
+        assert test_anki.import_file(str(source), model='test_model', deck='Words', chunk_size=2,
+                                     on_progress=lambda rows, seconds: progress.append(rows)) == 3
+        assert progress == [2, 3]
+
+        assert [fld['name'] for fld in test_anki._model('test_model')['flds']] == ['English', 'Spanish', 'French']
+        assert test_anki.count_notes(deck='Words') == 2
+        note, = test_anki.iter_notes(deck='Phrases')
+        assert note.fields['French'] == 'Bonjour'
+        assert note.tags == ['greeting']
+
+        assert test_anki.import_file(str(source), model='test_model', on_duplicate='skip') == 0
+
+        with pytest.raises(ValueError, match='Front, Back'):
+            test_anki.import_file(str(source), model='Basic')
+        with pytest.raises(ValueError, match='french'):
+            test_anki.import_file(str(source), model='test_model', columns=['English', 'Spanish', 'french'])
+        assert test_anki.count_notes() == 3
+
+
+def test_cli_import(tmpdir):
+    source = Path(str(tmpdir)).joinpath('words.jsonl')
+    source.write_text('\n'.join(json.dumps({'Front': front, 'Back': back})
+                                for front, back in [('Hello', 'Bonjour'), ('Flower', 'fleur')]), encoding='utf8')
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('cli_import.apkg')))
+
+    assert main(['import', str(source), out_file, '--deck', 'test', '--quiet']) == 0
+
+    with Anki(out_file) as test_anki:
+        assert [note.fields['Back'] for note in test_anki.iter_notes(deck='test')] == ['Bonjour', 'fleur']
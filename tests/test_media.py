@@ -0,0 +1,139 @@
+from pathlib import Path
+from zipfile import ZipFile, ZIP_DEFLATED
+import json
+from io import BytesIO, UnsupportedOperation
+import pytest
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki, media
+
+
+def test_add_media(tmpdir):
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('media.apkg')))
+    audio = Path(str(tmpdir)).joinpath('hello.mp3')
+    audio.write_bytes(b'ID3 hello')
+
+    with Anki(out_file) as test_anki:
+        name = test_anki.add_media(str(audio))
+        assert name == 'hello.mp3'
+        assert test_anki.add_media(b'ID3 hello', name='copy.mp3') == 'hello.mp3'
+        assert test_anki.add_media(b'<svg/>', name='image.svg') == 'image.svg'
+
+        test_anki.deck('test').add_item('Hello [sound:{}]'.format(name), 'Bonjour')
+
+    with ZipFile(out_file) as zf:
+        media = json.loads(zf.read('media').decode('utf8'))
+        assert sorted(media.values()) == ['hello.mp3', 'image.svg']
+        assert sorted(zf.read(k) for k in media.keys()) == [b'<svg/>', b'ID3 hello']
+
+    with Anki(out_file) as test_anki:
+        assert test_anki.media.read('hello.mp3') == b'ID3 hello'
+        assert test_anki.add_media(b'ID3 hello', name='other.mp3') == 'hello.mp3'
+        assert test_anki.add_media(b'<svg></svg>', name='image.svg') == 'image.svg'
+
+    with Anki(out_file) as test_anki:
+        assert sorted(test_anki.media.names()) == ['hello.mp3', 'image.svg']
+        assert test_anki.media.read('image.svg') == b'<svg></svg>'
+
+
+def test_save_compressed():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('compressed.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_anki.add_media(b'a' * 10000, name='a.txt')
+        test_anki.deck('test').add_item('Hello', 'Bonjour')
+
+    with ZipFile(out_file) as zf:
+        assert all(info.compress_type == ZIP_DEFLATED for info in zf.infolist())
+        assert zf.getinfo('0').compress_size < 10000
+
+    mtime = Path(out_file).stat().st_mtime_ns
+    with Anki(out_file) as test_anki:
+        assert test_anki.save() is False
+        assert test_anki.media.read('a.txt') == b'a' * 10000
+    assert Path(out_file).stat().st_mtime_ns == mtime
+
+    with Anki(out_file) as test_anki:
+        test_anki.add_media(b'b' * 10000, name='b.txt')
+
+    with ZipFile(out_file) as zf:
+        assert zf.testzip() is None
+        media = json.loads(zf.read('media').decode('utf8'))
+        assert {name: zf.read(k) for k, name in media.items()} == {'a.txt': b'a' * 10000, 'b.txt': b'b' * 10000}
+
+
+def test_save_recompressed(monkeypatch):
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('recompressed.apkg')))
+
+    with Anki(out_file) as test_anki:
+        test_anki.add_media(b'a' * 10000, name='a.txt')
+
+    # As if a version of zipfile lacked one of the internals of the compressed copy
+    monkeypatch.setattr(media, '_ZIPFILE_NAMES', media._ZIPFILE_NAMES + ('_FH_REMOVED', ))
+    monkeypatch.setattr(media, '_copy_compressed', None)
+
+    with Anki(out_file) as test_anki:
+        test_anki.add_media(b'b' * 10000, name='b.txt')
+
+    with ZipFile(out_file) as zf:
+        assert zf.testzip() is None
+        assert all(info.compress_type == ZIP_DEFLATED for info in zf.infolist())
+        media_map = json.loads(zf.read('media').decode('utf8'))
+        assert {name: zf.read(k) for k, name in media_map.items()} == {'a.txt': b'a' * 10000, 'b.txt': b'b' * 10000}
+
+
+def test_in_memory():
+    f = BytesIO()
+
+    with Anki(f, in_memory=True) as test_anki:
+        assert test_anki.temp_dir is None
+        test_anki.add_media(b'ID3 hello', name='hello.mp3')
+        test_anki.deck('test').add_item('Hello [sound:hello.mp3]', 'Bonjour')
+
+    with Anki(f, in_memory=True) as test_anki:
+        assert test_anki.count_notes(deck='test') == 1
+        assert test_anki.media.read('hello.mp3') == b'ID3 hello'
+        test_anki.deck('test').add_item('Flower', 'fleur')
+        test_anki.add_media(b'<svg/>', name='image.svg')
+
+    with Anki(f) as test_anki:
+        assert test_anki.count_notes(deck='test') == 2
+        assert sorted(test_anki.media.names()) == ['hello.mp3', 'image.svg']
+
+
+class _Stream(BytesIO):
+    """Write-only stream, such as a pipe or a response body.
+    """
+    def seekable(self):
+        return False
+
+    def seek(self, *args):
+        raise UnsupportedOperation('seek')
+
+    def tell(self):
+        raise UnsupportedOperation('tell')
+
+    def truncate(self, *args):
+        raise UnsupportedOperation('truncate')
+
+    def read(self, *args):
+        raise UnsupportedOperation('read')
+
+
+def test_unseekable():
+    f = _Stream()
+
+    test_anki = Anki(f, in_memory=True)
+    test_anki.add_media(b'ID3 hello', name='hello.mp3')
+    test_anki.deck('test').add_item('Hello [sound:hello.mp3]', 'Bonjour')
+    assert test_anki.save()
+    assert not test_anki.save()
+
+    test_anki.deck('test').add_item('Flower', 'fleur')
+    with pytest.raises(ValueError):
+        test_anki.save()
+    test_anki.close(save=False)
+
+    with Anki(BytesIO(f.getvalue())) as test_anki:
+        assert test_anki.count_notes(deck='test') == 1
+        assert test_anki.media.read('hello.mp3') == b'ID3 hello'
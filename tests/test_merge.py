@@ -0,0 +1,78 @@
+from pathlib import Path
+import shutil
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki
+
+
+def _make_package(name, words, model_fields=None):
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath(name)))
+
+    with Anki(out_file) as anki:
+        if model_fields is not None:
+            anki.new_model(name='test_model', fields=model_fields)
+            anki.deck('test').add_items(words, model='test_model')
+        else:
+            anki.deck('test').add_items(words)
+        anki.add_media(b'ID3 ' + name.encode(), name='{}.mp3'.format(name))
+
+    return out_file
+
+
+def test_merge():
+    main_file = _make_package('merge_main.apkg', [("Hello", "Bonjour"), ("Flower", "fleur")])
+    other_file = _make_package('merge_other.apkg', [("House", "Maison")])
+    third_file = _make_package('merge_third.apkg', [("Hello", "Hola", "Bonjour")],
+                               model_fields=["English", "Spanish", "French"])
+
+    with Anki(main_file) as anki:
+        assert anki.merge(other_file) == {'notes': 1, 'updated': 0, 'cards': 1, 'revlog': 0}
+        assert anki.merge(third_file)['notes'] == 1
+
+        # Merging again renames the guids, unless asked to skip them.
+        assert anki.merge(other_file, on_conflict='skip')['notes'] == 0
+        assert anki.merge(other_file)['notes'] == 1
+
+        assert tuple(anki.conn.execute('SELECT COUNT(DISTINCT id), COUNT(DISTINCT guid) FROM notes').fetchone()) == (5, 5)
+        assert anki.conn.execute('SELECT COUNT(DISTINCT id) FROM cards').fetchone()[0] == 5
+        assert anki.count_notes(deck='test') == 5
+        assert anki.count_notes(model='test_model') == 1
+        assert sorted(anki.media.names()) == ['merge_main.apkg.mp3', 'merge_other.apkg.mp3', 'merge_third.apkg.mp3']
+
+        anki.deck('test').add_item("Tree", "arbre")
+        assert anki.conn.execute('SELECT COUNT(DISTINCT id) FROM notes').fetchone()[0] == 6
+
+    with Anki(main_file) as anki:
+        assert anki.media.read('merge_other.apkg.mp3') == b'ID3 merge_other.apkg'
+
+
+def test_merge_renamed_twice():
+    main_file = _make_package('merge_twice.apkg', [("Hello", "Bonjour")])
+    other_file = _make_package('merge_twice_other.apkg', [("House", "Maison")])
+    copy_file = nonrepeat_filename(str(Path('tests/output').joinpath('merge_twice_copy.apkg')))
+
+    with Anki(main_file) as anki:
+        anki.merge(other_file)
+        anki.merge(other_file)
+    shutil.copy(main_file, copy_file)
+
+    # The incoming notes are renamed into the guids of one another.
+    with Anki(main_file) as anki:
+        assert anki.merge(copy_file)['notes'] == 3
+        assert tuple(anki.conn.execute('SELECT COUNT(*), COUNT(DISTINCT guid) FROM notes').fetchone()) == (6, 6)
+
+
+def test_merge_update():
+    main_file = _make_package('merge_update.apkg', [("Hello", "Bonjour")])
+    other_file = nonrepeat_filename(str(Path('tests/output').joinpath('merge_update_other.apkg')))
+
+    with Anki(main_file) as anki:
+        anki.save()
+    with Anki(other_file) as anki:
+        anki.merge(main_file)
+        anki.conn.execute('UPDATE notes SET flds = ?, mod = mod + 1', ("Hello\x1fSalut", ))
+
+    with Anki(main_file) as anki:
+        assert anki.merge(other_file, on_conflict='update')['updated'] == 1
+        note, = anki.iter_notes()
+        assert note.fields['Back'] == 'Salut'
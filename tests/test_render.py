@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import pytest
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki
+from AnkiPy.render import compile_template
+
+
+def test_compile_template():
+    render = compile_template('{{#Hint}}<i>{{text:Hint}}</i>{{/Hint}}{{^Hint}}no hint{{/Hint}} {{ Front }}')
+    assert render({'Front': 'a', 'Hint': '<b>h</b>'}, 0, '') == '<i>h</i> a'
+    assert render({'Front': 'a', 'Hint': ' '}, 0, '') == 'no hint a'
+
+    assert compile_template('{{cloze:Text}}')({'Text': '{{c1::a}} {{c2::b::hint}}'}, 1, '') == \
+        'a <span class=cloze>[hint]</span>'
+
+    with pytest.raises(ValueError):
+        compile_template('{{#Front}}')
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_render_cards(processes):
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('render.apkg')))
+
+    with Anki(out_file) as anki:
+        anki.new_model(name='test_model', fields=["English", "Spanish", "French"],
+                       templates=["{0} \n<hr id=answer>\n {1}<br>{2}", "{1} \n<hr id=answer>\n {0}"])
+        anki.deck('test').add_items((("Word {}".format(i), "Palabra {}".format(i), "Mot {}".format(i))
+                                     for i in range(25)), model='test_model')
+
+        cards = list(anki.render_cards(deck='test', processes=processes, chunk_size=10))
+        assert len(cards) == 50
+        assert cards[0][0] == anki.conn.execute('SELECT min(id) FROM cards').fetchone()[0]
+        assert cards[0][1:] == ('Word 0 \n', 'Word 0 \n<hr id=answer>\n Palabra 0<br>Mot 0')
+        assert cards[1][1:] == ('Palabra 0 \n', 'Palabra 0 \n<hr id=answer>\n Word 0')
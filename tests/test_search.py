@@ -0,0 +1,72 @@
+from pathlib import Path
+from zipfile import ZipFile
+
+from nonrepeat import nonrepeat_filename
+
+from AnkiPy import Anki, search
+
+
+def test_search():
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('search.apkg')))
+
+    with Anki(out_file) as anki:
+        anki.new_model(name='test_model', fields=["English", "Spanish", "French"])
+        anki.deck('test').add_items([("House", "<b>casa</b>", "maison"),
+                                     ("Little house", "casita", "maisonnette"),
+                                     ("Marriage", "boda", "mariage casa")], model='test_model')
+        anki.deck('other').add_items([("casa", "house")])
+
+        assert [note.fields['English'] for note in anki.search('casa', fields='Spanish')] == ['House']
+        assert len(list(anki.search('casa'))) == 3
+        assert [note.sfld for note in anki.search('casa', model='Basic')] == ['casa']
+        assert len(list(anki.search('casa', deck='test', limit=1))) == 1
+
+        anki.deck('test').add_item("Home", "casa", "foyer", model='test_model')
+        anki.update_notes(where={'model': 'test_model'}, set_fields={'Spanish': lambda v: v + ' nueva'})
+        assert len(list(anki.search('nueva', fields=['Spanish']))) == 4
+
+        anki.delete_notes(where={'deck': 'other'})
+        assert len(list(anki.search('casa'))) == 3
+
+    with ZipFile(out_file) as zf:
+        assert zf.namelist() == ['collection.anki2', 'media']
+
+    other_file = nonrepeat_filename(str(Path('tests/output').joinpath('search_other.apkg')))
+    with Anki(out_file) as anki:
+        assert anki.conn.execute('PRAGMA database_list').fetchall()[-1]['name'] == 'main'
+        assert len(list(anki.search('casa'))) == 3
+        assert anki.update_notes(where={'tag': 'not_existed'}, add_tags='other') == 0
+        assert anki.delete_notes(where=[0]) == {'notes': 0, 'cards': 0, 'revlog': 0}
+        assert not anki.save()
+
+        anki.deck('test').add_item("Town", "pueblo", "ville", model='test_model')
+        assert len(list(anki.search('pueblo'))) == 1
+        assert anki.save()
+
+    with Anki(other_file) as anki:
+        assert len(list(anki.search('casa'))) == 0
+        anki.merge(out_file)
+        assert len(list(anki.search('casa'))) == 3
+        assert anki.conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE name LIKE "%fts%"').fetchone()[0] == 0
+
+
+def test_search_rebuild(monkeypatch):
+    monkeypatch.setattr(search, 'REBUILD_THRESHOLD', 2)
+    out_file = nonrepeat_filename(str(Path('tests/output').joinpath('search_rebuild.apkg')))
+
+    with Anki(out_file) as anki:
+        anki.deck('test').add_items([("casa {}".format(i), "house") for i in range(5)])
+        assert len(list(anki.search('casa'))) == 5
+
+        assert anki.update_notes(where={}, add_tags='noun') == 5
+        assert search.is_built(anki.conn)
+
+        assert anki.update_notes(where={}, set_fields={'Back': 'maison'}) == 5
+        assert not search.is_built(anki.conn)
+        assert len(list(anki.search('maison'))) == 5
+
+        anki.delete_notes(where=[note.id for note in anki.search('"casa 0"')])
+        assert search.is_built(anki.conn)
+        assert anki.delete_notes(where={'tag': 'noun'})['notes'] == 4
+        assert not search.is_built(anki.conn)
+        assert len(list(anki.search('casa'))) == 0
@@ -0,0 +1,58 @@
+import pytest
+
+from AnkiPy.tools.text import strip_html, bs4_text
+
+pytest.importorskip('bs4')
+
+
+@pytest.mark.parametrize('html', [
+    'Hello',
+    'How are you ?',
+    'a<b>b</b>c',
+    '<p>a</p><p>b</p>',
+    '<ul><li>1</li><li>2</li></ul>',
+    '<br>line<br/>',
+    '<img src="a.jpg">',
+    '[sound:a.mp3]',
+    '<span style="color: red">red</span> &amp; blue',
+    '<b>bold</b>&nbsp;<i>it</i>',
+    '<a href="?a=1&b=2">link</a>',
+    '&amp; &lt;x&gt;',
+    '&amp',
+    '&ampx',
+    'x &gt y',
+    '&unknown; &copy &copy;',
+    '&#39;&#x27;&#x1F600;',
+    '&#0;&#128;',
+    'a&b',
+    'a & b',
+    'a < b',
+    'a<b',
+    'unclosed <div',
+    '<!-- comment -->x',
+    '<![CDATA[foo]]>bar',
+    '<!DOCTYPE html>d',
+    '<?php x ?>p',
+    '<script>var a = 1 < 2</script>t',
+    '<style>.card { color: red; }</style>s',
+    '<template>t</template>x',
+    '<textarea><b>x</b></textarea>',
+    '<div>日本語<ruby>漢<rp>(</rp><rt>かん</rt><rp>)</rp></ruby></div>',
+    '<b>Hello</b>  <i>world</i>',
+    '<div>x</div>\n    <div>y</div>',
+    '<ul>\n  <li>1</li>\r\n  <li>2</li>\n</ul>',
+    '   ',
+    '\t<br>',
+    '<b> </b>&nbsp; <!-- c --> <i>x</i>',
+    '<pre>  <b>x</b>\n  </pre>  ',
+    '<div><textarea> \n </div>\t',
+    '<textarea></pre>  </textarea>  ',
+    '<br>\n</br>  x',
+])
+def test_strip_html(html):
+    assert strip_html(html) == bs4_text(html)
+
+
+def test_strip_html_plain():
+    text = 'no markup at all'
+    assert strip_html(text) is text